@@ -0,0 +1,340 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BLOCK_SIZE = 65536
+PARTIAL_DIR = '.partial'
+STATE_FILE = 'sync_state.json'
+
+
+class SyncError(Exception):
+    """Raised when a file can't be downloaded or fails verification."""
+    pass
+
+
+class _RangeIgnored(SyncError):
+    """Raised when the origin answers a range request with the whole file."""
+    pass
+
+
+class _RateLimiter(object):
+    """Token bucket shared by all download threads to cap the total
+    bandwidth used by the sync.
+    """
+
+    def __init__(self, rate):
+        self._rate = rate
+        self._lock = threading.Lock()
+        self._allowance = rate
+        self._last = time.time()
+
+    def consume(self, amount):
+        """Block until amount bytes can be transferred without going over the
+        rate.  A rate of 0 means unlimited.
+        """
+        if self._rate <= 0:
+            return
+        with self._lock:
+            now = time.time()
+            self._allowance = min(self._rate, self._allowance +
+                                  (now - self._last) * self._rate)
+            self._last = now
+            self._allowance -= amount
+            wait = -self._allowance / self._rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+class ContentSync(object):
+
+    def __init__(self, config, log=print):
+        """Create an instance of a content sync that periodically pulls a
+        manifest from an HTTP origin and downloads new or changed movies
+        into the movie directory.  Files are downloaded next to the directory
+        and only moved into place once complete and verified, so the file
+        readers never see partial files.
+        """
+        self._log = log
+        self._changed = False
+        self._stopped = threading.Event()
+        self._thread = None
+        self._load_config(config)
+        self._limiter = _RateLimiter(self._bandwidth)
+        self._partial_path = os.path.join(self._directory, PARTIAL_DIR)
+        self._state_path = os.path.join(self._partial_path, STATE_FILE)
+
+    def _load_config(self, config):
+        section = 'content_sync'
+        self._enabled = config.getboolean(section, 'enabled', fallback=False)
+        self._manifest_url = config.get(section, 'manifest_url', fallback='')
+        self._interval = config.getfloat(section, 'interval', fallback=300.0)
+        self._directory = config.get(section, 'directory',
+                                     fallback='.kiosk/Videos')
+        self._playlist_path = config.get(section, 'playlist_path',
+                                         fallback='')
+        self._connections = max(1, config.getint(section, 'connections',
+                                                  fallback=4))
+        self._chunk_size = config.getint(section, 'chunk_size',
+                                         fallback=4194304)
+        self._bandwidth = config.getint(section, 'bandwidth',
+                                        fallback=1048576)
+        self._timeout = config.getfloat(section, 'timeout', fallback=30.0)
+        self._delete_removed = config.getboolean(section, 'delete_removed',
+                                                 fallback=False)
+
+    def start(self):
+        """Start syncing in a background thread if enabled."""
+        if not self._enabled or not self._manifest_url:
+            return
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop syncing after the current transfer block."""
+        self._stopped.set()
+
+    def is_changed(self):
+        """Return true once after new files were moved into the directory or
+        the playlist was rewritten.
+        """
+        if self._changed:
+            self._changed = False
+            return True
+        return False
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.sync()
+            except (SyncError, IOError, OSError, KeyError, ValueError) as e:
+                self._log('Content sync failed: {0}'.format(e))
+            self._stopped.wait(self._interval)
+
+    def sync(self):
+        """Download the manifest and every missing or changed file in it."""
+        os.makedirs(self._partial_path, exist_ok=True)
+        manifest = json.loads(self._fetch(self._manifest_url).decode('utf-8'))
+        state = self._load_state()
+        synced = {}
+        changed = False
+        for entry in manifest['files']:
+            if self._stopped.is_set():
+                break
+            # A bad entry or failed download only skips that file, the
+            # others are still synced.
+            name = None
+            try:
+                name = self._entry_name(entry)
+                if self._sync_file(name, entry, state.get(name)):
+                    # Publish right away so files that landed are played
+                    # even if a later file fails.
+                    changed = True
+                    self._changed = True
+                st = os.stat(os.path.join(self._directory, name))
+                synced[name] = {'size': st.st_size, 'mtime': st.st_mtime,
+                                'sha256': entry['sha256'].lower()}
+            except (SyncError, IOError, OSError, AttributeError, KeyError,
+                    TypeError, ValueError) as e:
+                self._log('Failed to sync {0}: {1}'.format(
+                    name or entry, e))
+                # Keep the previous version, if any, in the state so it
+                # isn't deleted as removed from the manifest.
+                if name in state:
+                    synced[name] = state[name]
+        if self._stopped.is_set():
+            # Files after the stop weren't looked at, don't delete them.
+            return
+        if self._delete_removed:
+            for name in state:
+                if name not in synced:
+                    try:
+                        os.remove(os.path.join(self._directory, name))
+                        changed = True
+                    except OSError:
+                        pass
+        self._save_state(synced)
+        if self._playlist_path and self._write_playlist(
+                [os.path.abspath(os.path.join(self._directory, name))
+                 for name in synced
+                 if os.path.exists(os.path.join(self._directory, name))]):
+            changed = True
+        if changed:
+            self._changed = True
+
+    def _entry_name(self, entry):
+        """Return the file name of a manifest entry after checking the entry
+        can't write outside the directory.
+        """
+        name = os.path.basename(entry['name'])
+        if not name or name.startswith('.'):
+            raise SyncError('invalid file name {0}'.format(entry['name']))
+        # The hash names the part files, so it must not contain a path.
+        if not re.match(r'^[0-9a-f]{64}$', entry['sha256'].lower()):
+            raise SyncError('invalid sha256 for {0}'.format(name))
+        return name
+
+    def _sync_file(self, name, entry, known):
+        """Download the manifest entry if it is missing or changed.  Returns
+        true if a new version was moved into the directory.
+        """
+        target = os.path.join(self._directory, name)
+        if self._is_current(target, known, entry):
+            return False
+        url = urllib.parse.urljoin(self._manifest_url, entry.get('url', name))
+        self._log('Syncing {0}'.format(name))
+        self._download(url, target, int(entry['size']),
+                       entry['sha256'].lower())
+        return True
+
+    def _is_current(self, target, known, entry):
+        """Return true if target already holds the manifest version, using
+        the recorded size and mtime to avoid hashing unchanged files.
+        """
+        try:
+            st = os.stat(target)
+        except OSError:
+            return False
+        if st.st_size != int(entry['size']):
+            return False
+        if known is not None and known['size'] == st.st_size and \
+                known['mtime'] == st.st_mtime:
+            return known['sha256'] == entry['sha256'].lower()
+        return self._hash_file(target) == entry['sha256'].lower()
+
+    def _hash_file(self, path):
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+                sha.update(block)
+        return sha.hexdigest()
+
+    def _load_state(self):
+        try:
+            with open(self._state_path, 'r') as state_file:
+                return json.load(state_file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _save_state(self, state):
+        self._write_atomic(self._state_path, json.dumps(state))
+
+    def _write_playlist(self, movies):
+        """Rewrite the playlist file if its content changed.  Returns true if
+        it was rewritten.
+        """
+        content = ''.join(movie + '\n' for movie in movies)
+        try:
+            with open(self._playlist_path, 'r') as playlist_file:
+                if playlist_file.read() == content:
+                    return False
+        except (IOError, OSError):
+            pass
+        self._write_atomic(self._playlist_path, content)
+        return True
+
+    def _write_atomic(self, path, content):
+        """Write content to a temporary file then rename it over path so
+        readers see either the old or the new file, never a partial one.
+        """
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _open(self, url, offset=None, end=None):
+        request = urllib.request.Request(url)
+        if offset is not None:
+            request.add_header('Range', 'bytes={0}-{1}'.format(offset, end))
+        return urllib.request.urlopen(request, timeout=self._timeout)
+
+    def _fetch(self, url):
+        with self._open(url) as response:
+            return response.read()
+
+    def _download(self, url, target, size, sha256):
+        """Download url in parallel ranges into part files named after the
+        expected hash, so an interrupted transfer resumes where it stopped
+        even after a restart.  Then verify and move the file into place.
+        """
+        prefix = os.path.join(self._partial_path, sha256)
+        ranges = [(start, min(start + self._chunk_size, size) - 1)
+                  for start in range(0, size, self._chunk_size)]
+        parts = ['{0}.{1}'.format(prefix, i) for i in range(len(ranges))]
+        if len(ranges) == 1:
+            # A single chunk needs no ranges, the origin may send it whole.
+            self._download_range(url, parts[0], 0, size - 1, whole=True)
+        elif ranges:
+            try:
+                with ThreadPoolExecutor(max_workers=self._connections) \
+                        as pool:
+                    futures = [pool.submit(self._download_range, url, part,
+                                           start, end)
+                               for part, (start, end) in zip(parts, ranges)]
+                    for future in futures:
+                        future.result()
+            except _RangeIgnored:
+                # Plain origin (like python3 -m http.server): fall back to
+                # downloading the whole file in one request.
+                for part in parts:
+                    if os.path.exists(part):
+                        os.remove(part)
+                parts = parts[:1]
+                self._download_range(url, parts[0], 0, size - 1, whole=True)
+        # Join the parts while hashing, then verify before moving the file
+        # into the movie directory.
+        tmp_path = prefix + '.tmp'
+        sha = hashlib.sha256()
+        with open(tmp_path, 'wb') as out:
+            for part in parts:
+                with open(part, 'rb') as f:
+                    for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+                        sha.update(block)
+                        out.write(block)
+            out.flush()
+            os.fsync(out.fileno())
+        for part in parts:
+            os.remove(part)
+        if sha.hexdigest() != sha256:
+            os.remove(tmp_path)
+            raise SyncError('hash mismatch for {0}'.format(url))
+        os.replace(tmp_path, target)
+
+    def _download_range(self, url, part, start, end, whole=False):
+        """Download bytes start to end (inclusive) of url into part, resuming
+        from what is already in part.  With whole set, the range covers the
+        whole file and the origin may ignore the range and send everything.
+        """
+        offset = start
+        if os.path.exists(part):
+            offset += os.path.getsize(part)
+        if offset > end:
+            return
+        mode = 'ab'
+        with self._open(url, offset, end) as response:
+            if response.status != 206:
+                if not whole:
+                    raise _RangeIgnored('origin ignored range request for '
+                                        '{0}'.format(url))
+                # The whole body is coming, start the part over.
+                offset = start
+                mode = 'wb'
+            with open(part, mode) as f:
+                while offset <= end:
+                    if self._stopped.is_set():
+                        raise SyncError('sync stopped')
+                    block = response.read(min(BLOCK_SIZE, end - offset + 1))
+                    if not block:
+                        raise SyncError('transfer of {0} interrupted'
+                                        .format(url))
+                    self._limiter.consume(len(block))
+                    f.write(block)
+                    offset += len(block)
@@ -0,0 +1,165 @@
+import json
+import os
+import time
+
+
+class FailureTracker(object):
+
+    def __init__(self, config):
+        """Create an instance of a tracker that watches for movies which make
+        the video player exit right after it is started (missing or corrupt
+        files) and backs off from playing them again.
+        """
+        self._items = {}
+        self._global_failures = 0
+        self._global_retry_at = 0
+        self._counters = {'plays': 0, 'failures': 0, 'quarantines': 0,
+                          'global_backoffs': 0}
+        self._load_config(config)
+
+    def _load_config(self, config):
+        section = 'failure_tracker'
+        self._min_play_time = config.getfloat(section, 'min_play_time',
+                                              fallback=2.0)
+        self._base_backoff = config.getfloat(section, 'base_backoff',
+                                             fallback=1.0)
+        self._max_backoff = config.getfloat(section, 'max_backoff',
+                                            fallback=300.0)
+        self._quarantine_after = config.getint(section, 'quarantine_after',
+                                               fallback=5)
+        self._quarantine_retry = config.getfloat(section, 'quarantine_retry',
+                                                 fallback=3600.0)
+        self._global_max_backoff = config.getfloat(section,
+                                                   'global_max_backoff',
+                                                   fallback=60.0)
+        self._status_path = config.get(section, 'status_path',
+                                       fallback='/run/shm/video_looper_status.json')
+
+    def _item(self, movie):
+        item = self._items.get(movie)
+        if item is None:
+            item = {'failures': 0, 'total_failures': 0, 'plays': 0,
+                    'retry_at': 0, 'quarantined': False}
+            self._items[movie] = item
+        return item
+
+    def _backoff(self, failures, maximum):
+        """Return the exponential backoff delay for a number of consecutive
+        failures, capped at the provided maximum.
+        """
+        return min(self._base_backoff * (2 ** (failures - 1)), maximum)
+
+    def is_available(self, movie, now=None):
+        """Return true if the movie is not currently backed off or
+        quarantined.  A quarantined movie becomes available again once every
+        quarantine_retry seconds so it can recover if the file is fixed.
+        """
+        item = self._items.get(movie)
+        if item is None:
+            return True
+        if now is None:
+            now = time.time()
+        return now >= item['retry_at']
+
+    def retry_at(self, movie):
+        """Return the time at which the movie comes out of backoff or
+        quarantine, or 0 if it is available.
+        """
+        item = self._items.get(movie)
+        return 0 if item is None else item['retry_at']
+
+    def global_wait(self, now=None):
+        """Return how many seconds to wait before starting any movie because
+        everything recently failed, or 0 if playback can go ahead.
+        """
+        if now is None:
+            now = time.time()
+        return max(0, self._global_retry_at - now)
+
+    def finished(self, movie, elapsed, playlist_length, now=None):
+        """Record that the player exited on its own after playing movie for
+        elapsed seconds.  Returns true if the exit was counted as a failure.
+        """
+        if now is None:
+            now = time.time()
+        item = self._item(movie)
+        if elapsed >= self._min_play_time:
+            item['failures'] = 0
+            item['plays'] += 1
+            item['retry_at'] = 0
+            item['quarantined'] = False
+            self._global_failures = 0
+            self._global_retry_at = 0
+            self._counters['plays'] += 1
+            self._write_status()
+            return False
+        item['failures'] += 1
+        item['total_failures'] += 1
+        self._counters['failures'] += 1
+        if item['failures'] >= self._quarantine_after:
+            if not item['quarantined']:
+                self._counters['quarantines'] += 1
+            item['quarantined'] = True
+            item['retry_at'] = now + self._quarantine_retry
+        else:
+            item['retry_at'] = now + self._backoff(item['failures'],
+                                                   self._max_backoff)
+        # Every movie in a row failing means the problem is probably not the
+        # files (player missing, display gone...), so slow everything down.
+        self._global_failures += 1
+        if self._global_failures >= max(playlist_length, 1):
+            self._global_retry_at = now + self._backoff(
+                self._global_failures - max(playlist_length, 1) + 1,
+                self._global_max_backoff)
+            self._counters['global_backoffs'] += 1
+        self._write_status()
+        return True
+
+    def is_quarantined(self, movie):
+        """Return true if the movie has failed too many times in a row."""
+        item = self._items.get(movie)
+        return item is not None and item['quarantined']
+
+    def reset(self):
+        """Forget all failures, called when the playlist is rebuilt since new
+        files may have replaced the broken ones.
+        """
+        self._items = {}
+        self._global_failures = 0
+        self._global_retry_at = 0
+        self._write_status()
+
+    def status(self, now=None):
+        """Return a dictionary with failure counters and per movie state."""
+        if now is None:
+            now = time.time()
+        items = {}
+        for movie, item in self._items.items():
+            if item['total_failures'] == 0:
+                continue
+            items[movie] = {
+                'failures': item['failures'],
+                'total_failures': item['total_failures'],
+                'plays': item['plays'],
+                'quarantined': item['quarantined'],
+                'retry_in': round(max(0, item['retry_at'] - now), 1)}
+        return {'metrics': dict(self._counters),
+                'quarantined': sum(1 for i in self._items.values()
+                                   if i['quarantined']),
+                'global_wait': round(self.global_wait(now), 1),
+                'items': items}
+
+    def _write_status(self):
+        """Write the status to the status file, replacing it atomically so
+        readers never see a partial file.
+        """
+        if not self._status_path:
+            return
+        tmp_path = self._status_path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as status_file:
+                json.dump(self.status(), status_file)
+            os.replace(tmp_path, self._status_path)
+        except (IOError, OSError):
+            pass
+
@@ -0,0 +1,200 @@
+import bisect
+import collections
+import json
+import os
+import threading
+import time
+import traceback
+
+# Upper bounds in seconds of the heartbeat gap histogram buckets, the last
+# bucket counts everything above.
+BUCKETS = (0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60)
+
+
+class _Worker(object):
+    """State of one supervised thread."""
+
+    def __init__(self, name, target, budget):
+        self.name = name
+        self.target = target
+        self.budget = budget
+        self.thread = None
+        self.last_beat = time.monotonic()
+        self.stalled = False
+        self.restarts = 0
+        # Monotonic times of the restarts within the restart window.
+        self.recent_restarts = collections.deque()
+        self.stalls = 0
+        self.max_gap = 0
+        self.histogram = [0] * (len(BUCKETS) + 1)
+
+
+class HeartbeatRegistry(object):
+
+    def __init__(self, config, log=print, on_exit=None):
+        """Create an instance of a registry supervising the looper background
+        threads.  Each thread loop calls beat() with its name, and a watchdog
+        thread restarts threads that died and exits the process (so
+        supervisord respawns it) when a thread stops beating for longer than
+        its budget.  on_exit is called before exiting to stop anything the
+        process started, like the video player.
+        """
+        self._log = log
+        self._on_exit = on_exit
+        self._config = config
+        self._workers = {}
+        self._running = False
+        self._watchdog = None
+        self._load_config(config)
+
+    def _load_config(self, config):
+        section = 'heartbeat'
+        self._check_interval = config.getfloat(section, 'check_interval',
+                                               fallback=1.0)
+        self._budget = config.getfloat(section, 'budget', fallback=10.0)
+        self._stall_action = config.get(section, 'stall_action',
+                                        fallback='exit').lower()
+        assert self._stall_action in ('exit', 'log'), 'Unknown heartbeat \
+        stall_action configuration value: {0} Expected exit or log.'\
+        .format(self._stall_action)
+        self._max_restarts = config.getint(section, 'max_restarts',
+                                           fallback=5)
+        self._restart_window = config.getfloat(section, 'restart_window',
+                                               fallback=3600.0)
+        self._status_path = config.get(section, 'status_path',
+                                       fallback='/run/shm/video_looper_heartbeats.json')
+
+    def start_worker(self, name, target, budget=None):
+        """Run target in a supervised daemon thread.  The target must call
+        beat(name) at least every budget seconds, by default the <name>_budget
+        configuration value or else the budget value.
+        """
+        if budget is None:
+            budget = self._config.getfloat('heartbeat', name + '_budget',
+                                           fallback=self._budget)
+        worker = _Worker(name, target, budget)
+        self._workers[name] = worker
+        if self._watchdog is None:
+            # Set before the first thread starts so an early crash is logged.
+            self._running = True
+        self._start_thread(worker)
+        if self._watchdog is None:
+            self._watchdog = threading.Thread(target=self._watch,
+                                              name='watchdog')
+            self._watchdog.daemon = True
+            self._watchdog.start()
+
+    def beat(self, name):
+        """Record that the named thread is alive and making progress."""
+        worker = self._workers.get(name)
+        if worker is None:
+            return
+        now = time.monotonic()
+        gap = now - worker.last_beat
+        worker.last_beat = now
+        worker.histogram[bisect.bisect_left(BUCKETS, gap)] += 1
+        if gap > worker.max_gap:
+            worker.max_gap = gap
+        if worker.stalled:
+            worker.stalled = False
+            self._log('Thread {0} recovered after {1:.1f}s stall'
+                      .format(name, gap))
+
+    def stop(self):
+        """Stop supervising, threads exiting from now on are not restarted."""
+        self._running = False
+
+    def _start_thread(self, worker):
+        worker.last_beat = time.monotonic()
+        worker.thread = threading.Thread(target=self._run_worker,
+                                         args=(worker,), name=worker.name)
+        worker.thread.daemon = True
+        worker.thread.start()
+
+    def _run_worker(self, worker):
+        try:
+            worker.target()
+        except Exception:
+            if self._running:
+                self._log('Thread {0} crashed: {1}'.format(
+                    worker.name, traceback.format_exc()))
+
+    def _watch(self):
+        while self._running:
+            time.sleep(self._check_interval)
+            if not self._running:
+                return
+            now = time.monotonic()
+            for worker in list(self._workers.values()):
+                if not worker.thread.is_alive():
+                    recent = worker.recent_restarts
+                    while recent and now - recent[0] > self._restart_window:
+                        recent.popleft()
+                    if len(recent) >= self._max_restarts:
+                        self._exit('Thread {0} died {1} times in {2:.0f}s'
+                                   .format(worker.name, len(recent) + 1,
+                                           self._restart_window))
+                        return
+                    recent.append(now)
+                    worker.restarts += 1
+                    self._log('Restarting thread {0}'.format(worker.name))
+                    self._start_thread(worker)
+                    continue
+                stall = now - worker.last_beat
+                if stall > worker.budget and not worker.stalled:
+                    worker.stalled = True
+                    worker.stalls += 1
+                    message = 'Thread {0} stalled for {1:.1f}s (budget ' \
+                              '{2:.1f}s)'.format(worker.name, stall,
+                                                 worker.budget)
+                    if self._stall_action == 'exit':
+                        self._exit(message)
+                        return
+                    self._log(message)
+            self._write_status(now)
+
+    def _exit(self, message):
+        """Exit the whole process so supervisord starts a fresh looper."""
+        self._log(message + ', exiting.')
+        self._write_status(time.monotonic())
+        if self._on_exit is not None:
+            try:
+                self._on_exit()
+            except Exception:
+                self._log('Failed to clean up before exiting: {0}'
+                          .format(traceback.format_exc()))
+        # Give the log writer a moment to write the message out.
+        time.sleep(0.5)
+        os._exit(1)
+
+    def status(self, now=None):
+        """Return a dictionary with the state of every supervised thread and
+        the histogram of the gaps between its heartbeats.
+        """
+        if now is None:
+            now = time.monotonic()
+        labels = ['<={0}s'.format(b) for b in BUCKETS] + \
+                 ['>{0}s'.format(BUCKETS[-1])]
+        status = {}
+        for worker in list(self._workers.values()):
+            status[worker.name] = {
+                'alive': worker.thread is not None and
+                worker.thread.is_alive(),
+                'last_beat': round(now - worker.last_beat, 3),
+                'budget': worker.budget,
+                'restarts': worker.restarts,
+                'stalls': worker.stalls,
+                'max_gap': round(worker.max_gap, 3),
+                'histogram': dict(zip(labels, worker.histogram))}
+        return status
+
+    def _write_status(self, now):
+        if not self._status_path:
+            return
+        tmp_path = self._status_path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as status_file:
+                json.dump(self.status(now), status_file)
+            os.replace(tmp_path, self._status_path)
+        except (IOError, OSError):
+            pass
@@ -0,0 +1,148 @@
+import collections
+import json
+import os
+import queue
+import threading
+import time
+
+LEVELS = ('debug', 'info', 'warning', 'error')
+
+
+class AsyncLog(object):
+
+    def __init__(self, config, console_output=True):
+        """Create an instance of a structured log.  Callers only append the
+        record to an in-memory ring and a bounded queue, a background thread
+        does the blocking writes to the console and the rotated log file.
+        """
+        self._console_output = console_output
+        self._dropped = 0
+        self._load_config(config)
+        self._ring = collections.deque(maxlen=self._ring_size)
+        self._queue = queue.Queue(maxsize=self._queue_size)
+        self._file = None
+        self._thread = threading.Thread(target=self._writer)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _load_config(self, config):
+        section = 'log'
+        self._path = config.get(section, 'path',
+                                fallback='/home/wattah/.kiosk/video_looper.log')
+        self._max_bytes = config.getint(section, 'max_bytes',
+                                        fallback=1048576)
+        self._backups = config.getint(section, 'backups', fallback=3)
+        self._queue_size = config.getint(section, 'queue_size',
+                                         fallback=1000)
+        self._ring_size = config.getint(section, 'ring_size', fallback=500)
+        self._dump_path = config.get(section, 'dump_path',
+                                     fallback='/run/shm/video_looper_log.json')
+
+    def log(self, message, level='info', **fields):
+        """Record a message with optional extra fields.  Never blocks: if the
+        writer falls behind the record is still kept in the ring but not
+        written out.
+        """
+        record = {'time': time.time(), 'level': level,
+                  'thread': threading.current_thread().name,
+                  'message': message}
+        record.update(fields)
+        self._ring.append(record)
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self._dropped += 1
+
+    def recent(self, count=None, level=None):
+        """Return up to count of the most recent records, oldest first,
+        optionally only those at or above level.
+        """
+        records = list(self._ring)
+        if level in LEVELS:
+            minimum = LEVELS.index(level)
+            records = [r for r in records
+                       if r['level'] not in LEVELS or
+                       LEVELS.index(r['level']) >= minimum]
+        if count is not None:
+            count = int(count)
+            records = records[-count:] if count > 0 else []
+        return records
+
+    def dump(self, count=None, level=None):
+        """Write the most recent records as JSON to the configured dump path,
+        replacing the file atomically.
+        """
+        path = self._dump_path
+        if not path:
+            return
+        dump = {'dropped': self._dropped,
+                'records': self.recent(count, level)}
+        tmp_path = path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as dump_file:
+                json.dump(dump, dump_file, default=str)
+            os.replace(tmp_path, path)
+        except (IOError, OSError) as e:
+            self.log('Failed to dump log to {0}: {1}'.format(path, e),
+                     'error')
+
+    def stop(self):
+        """Write out everything still queued and stop the writer thread."""
+        try:
+            self._queue.put(None, timeout=1)
+        except queue.Full:
+            return
+        self._thread.join(2)
+
+    def _writer(self):
+        while True:
+            records = [self._queue.get()]
+            # Drain whatever else is queued so it is written in one go.
+            try:
+                while len(records) < 100:
+                    records.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            stop = None in records
+            records = [r for r in records if r is not None]
+            if self._console_output:
+                # A console error must not end the writer thread.
+                try:
+                    for record in records:
+                        print(record['message'])
+                except (IOError, OSError, ValueError):
+                    pass
+            self._write(records)
+            if stop:
+                if self._file is not None:
+                    self._file.close()
+                return
+
+    def _write(self, records):
+        if not self._path or not records:
+            return
+        try:
+            if self._file is None:
+                self._file = open(self._path, 'a')
+            for record in records:
+                self._file.write(json.dumps(record, default=str) + '\n')
+            self._file.flush()
+            if self._file.tell() >= self._max_bytes:
+                self._rotate()
+        except (IOError, OSError, TypeError, ValueError):
+            pass
+
+    def _rotate(self):
+        """Rename the log file to path.1, path.1 to path.2 and so on, keeping
+        at most the configured number of backups.
+        """
+        self._file.close()
+        self._file = None
+        for i in range(self._backups - 1, 0, -1):
+            old_path = '{0}.{1}'.format(self._path, i)
+            if os.path.exists(old_path):
+                os.replace(old_path, '{0}.{1}'.format(self._path, i + 1))
+        if self._backups > 0:
+            os.replace(self._path, self._path + '.1')
+        else:
+            os.remove(self._path)
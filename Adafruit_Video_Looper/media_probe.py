@@ -0,0 +1,261 @@
+import json
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class MediaProber(object):
+
+    def __init__(self, config, log=print, store=None):
+        """Create an instance of a media prober that reads the container
+        headers of movie files with ffprobe in the background and remembers
+        which files are truncated or use codecs the player can't handle.
+        When a media store is provided results are shared by every copy of
+        the same content.
+        """
+        self._log = log
+        self._store = store
+        self._lock = threading.Lock()
+        self._results = {}
+        self._pending = set()
+        # Set when results changed since the cache was last saved.
+        self._dirty = False
+        self._next_probe_at = 0
+        self._load_config(config)
+        self._load_cache()
+        self._pool = None
+        if self._enabled:
+            self._pool = ThreadPoolExecutor(max_workers=self._workers)
+
+    def _load_config(self, config):
+        section = 'media_probe'
+        self._enabled = config.getboolean(section, 'enabled', fallback=True)
+        self._workers = max(1, config.getint(section, 'workers', fallback=1))
+        self._nice = config.getint(section, 'nice', fallback=19)
+        self._min_interval = config.getfloat(section, 'min_interval',
+                                             fallback=1.0)
+        self._timeout = config.getfloat(section, 'timeout', fallback=30.0)
+        self._cache_path = config.get(section, 'cache_path',
+                                      fallback='/home/wattah/.kiosk/media_probe.json')
+        self._video_codecs = [c for c in config.get(
+            section, 'video_codecs', fallback='')
+            .translate(str.maketrans('', '', ' \t\r\n')).lower().split(',')
+            if c]
+
+    def _load_cache(self):
+        """Load previous probe results so unchanged files aren't probed again
+        after a restart.
+        """
+        if not self._cache_path or not os.path.isfile(self._cache_path):
+            return
+        try:
+            with open(self._cache_path, 'r') as cache_file:
+                self._results = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            self._results = {}
+
+    def _save_cache(self):
+        """Save the results once no probe is left to run, so a batch of new
+        files rewrites the cache once instead of after every probe.
+        """
+        with self._lock:
+            if self._pending or not self._dirty:
+                return
+            self._dirty = False
+            results = dict(self._results)
+        if not self._cache_path:
+            return
+        tmp_path = self._cache_path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as cache_file:
+                json.dump(results, cache_file)
+            os.replace(tmp_path, self._cache_path)
+        except (IOError, OSError):
+            pass
+
+    def _stat(self, path):
+        """Return the (size, mtime) pair identifying the current version of
+        a file, or None if it can't be read.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime
+
+    def _content_id(self, path):
+        if self._store is None:
+            return None
+        return self._store.content_id(path)
+
+    def _cached(self, path, key=None):
+        """Return the probe result for the current version of path, or None
+        if it hasn't been probed since it last changed.
+        """
+        content_id = self._content_id(path)
+        if content_id is not None:
+            # Content IDs change with the content, no need to check the
+            # size and modification time.
+            return self._results.get(content_id)
+        if key is None:
+            key = self._stat(path)
+        if key is None:
+            return None
+        result = self._results.get(path)
+        if result is None or (result['size'], result['mtime']) != key:
+            return None
+        return result
+
+    def check(self, movies):
+        """Return the movies that aren't known to be unplayable, and queue
+        new or changed files to be probed in the background.  Files that
+        haven't been probed yet are kept so playback can start right away.
+        Results of files no longer listed are dropped.
+        """
+        playable = []
+        movies = list(movies)
+        keep = set(movies)
+        for movie in movies:
+            content_id = self._content_id(movie)
+            if content_id is not None:
+                keep.add(content_id)
+        with self._lock:
+            for key in [k for k in self._results if k not in keep]:
+                del self._results[key]
+                self._dirty = True
+        for movie in movies:
+            key = self._stat(movie)
+            with self._lock:
+                result = self._cached(movie, key)
+                if result is None and key is not None and self._enabled \
+                        and movie not in self._pending:
+                    self._pending.add(movie)
+                    self._pool.submit(self._probe, movie, key)
+            if result is None or result['ok']:
+                playable.append(movie)
+            else:
+                self._log('Skipping unplayable movie {0}: {1}'
+                          .format(movie, result['error']))
+        self._save_cache()
+        return playable
+
+    def is_valid(self, movie):
+        """Return false if the movie was probed and found unplayable."""
+        with self._lock:
+            result = self._cached(movie)
+        return result is None or result['ok']
+
+    def info(self, movie):
+        """Return the probe result dictionary for the movie (duration,
+        codecs, resolution), or None if it hasn't been probed yet.
+        """
+        with self._lock:
+            result = self._cached(movie)
+        return None if result is None else dict(result)
+
+    def duration(self, movie):
+        """Return the duration of the movie in seconds, or None if unknown."""
+        result = self.info(movie)
+        return None if result is None else result['duration']
+
+    def _wait_turn(self):
+        """Space out probes by min_interval seconds so probing never takes
+        over the CPU and SD card while a movie is playing.
+        """
+        with self._lock:
+            now = time.time()
+            start = max(now, self._next_probe_at)
+            self._next_probe_at = start + self._min_interval
+        if start > now:
+            time.sleep(start - now)
+
+    def _probe(self, movie, key):
+        try:
+            self._wait_turn()
+            args = ['nice', '-n', str(self._nice), 'ffprobe', '-v', 'error',
+                    '-print_format', 'json', '-show_format', '-show_streams',
+                    movie]
+            try:
+                output = subprocess.run(args, stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE,
+                                        timeout=self._timeout)
+            except subprocess.TimeoutExpired:
+                # Leave the file unprobed so it is tried again later.
+                return
+            except OSError as e:
+                # nice itself is missing or can't be run.
+                self._log('Failed to run ffprobe ({0}), disabling media '
+                          'probing.'.format(e))
+                self._disable()
+                return
+            # nice exits with 127 when it can't find the command to run.
+            if output.returncode == 127:
+                self._log('ffprobe not found, disabling media probing.')
+                self._disable()
+                return
+            result = self._parse(output)
+            result['size'], result['mtime'] = key
+            with self._lock:
+                self._results[self._content_id(movie) or movie] = result
+                self._dirty = True
+            if not result['ok']:
+                self._log('Probe failed for {0}: {1}'
+                          .format(movie, result['error']))
+        finally:
+            with self._lock:
+                self._pending.discard(movie)
+            self._save_cache()
+
+    def _parse(self, output):
+        """Turn ffprobe output into a probe result dictionary."""
+        result = {'ok': False, 'error': None, 'duration': None,
+                  'video_codec': None, 'audio_codec': None,
+                  'width': None, 'height': None}
+        if output.returncode != 0:
+            result['error'] = output.stderr.decode('utf-8', 'replace') \
+                                           .strip() or 'ffprobe failed'
+            return result
+        try:
+            probe = json.loads(output.stdout.decode('utf-8', 'replace'))
+        except ValueError:
+            result['error'] = 'unreadable ffprobe output'
+            return result
+        for stream in probe.get('streams', []):
+            codec_type = stream.get('codec_type')
+            if codec_type == 'video' and result['video_codec'] is None:
+                result['video_codec'] = stream.get('codec_name')
+                result['width'] = stream.get('width')
+                result['height'] = stream.get('height')
+            elif codec_type == 'audio' and result['audio_codec'] is None:
+                result['audio_codec'] = stream.get('codec_name')
+        try:
+            result['duration'] = float(probe['format']['duration'])
+        except (KeyError, TypeError, ValueError):
+            pass
+        if result['video_codec'] is None:
+            result['error'] = 'no video stream'
+        elif self._video_codecs and \
+                result['video_codec'].lower() not in self._video_codecs:
+            result['error'] = 'unsupported video codec {0}' \
+                              .format(result['video_codec'])
+        elif not result['width'] or not result['height']:
+            result['error'] = 'unknown resolution'
+        elif not result['duration'] or result['duration'] <= 0:
+            result['error'] = 'unknown duration'
+        else:
+            result['ok'] = True
+        return result
+
+    def _disable(self):
+        with self._lock:
+            self._enabled = False
+
+    def stop(self):
+        """Stop probing without waiting for running probes to finish."""
+        # Disable under the lock so check() can't submit to the pool once it
+        # is shut down.
+        self._disable()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
@@ -0,0 +1,274 @@
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class MediaStore(object):
+
+    def __init__(self, config, log=print):
+        """Create an instance of a content addressed index of movie files.
+        Files are identified by a hash of their content so copies of the same
+        movie on different drives or under different names collapse into a
+        single entry with several source paths.
+        """
+        self._log = log
+        self._lock = threading.Lock()
+        self._index = {}
+        self._ids = {}
+        self._sources = {}
+        self._changed = False
+        # Bumped by every update() so stale background passes give up.
+        self._generation = 0
+        self._load_config(config)
+        self._load_index()
+        self._pool = None
+        if self._enabled:
+            # Hash in the background so reading large files never blocks the
+            # main loop.
+            self._pool = ThreadPoolExecutor(max_workers=1)
+
+    def _load_config(self, config):
+        section = 'media_store'
+        self._enabled = config.getboolean(section, 'enabled', fallback=True)
+        self._index_path = config.get(section, 'index_path',
+                                      fallback='/home/wattah/.kiosk/media_store.json')
+        self._sample_size = config.getint(section, 'sample_size',
+                                          fallback=16384)
+
+    def _load_index(self):
+        """Load the hashes computed by previous runs so only new or changed
+        files are read again.
+        """
+        if not self._enabled or not self._index_path or \
+                not os.path.isfile(self._index_path):
+            return
+        try:
+            with open(self._index_path, 'r') as index_file:
+                self._index = json.load(index_file)
+        except (IOError, OSError, ValueError):
+            self._index = {}
+
+    def _save_index(self):
+        if not self._index_path:
+            return
+        with self._lock:
+            index = dict(self._index)
+        tmp_path = self._index_path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as index_file:
+                json.dump(index, index_file)
+            os.replace(tmp_path, self._index_path)
+        except (IOError, OSError):
+            pass
+
+    def _sample_hash(self, path, size):
+        """Hash the size and three blocks at the start, middle and end of the
+        file.  Small files are hashed entirely, which makes the sampled hash
+        a full hash for them.
+        """
+        h = hashlib.blake2b(digest_size=16)
+        h.update(str(size).encode('ascii'))
+        with open(path, 'rb') as f:
+            if size <= 3 * self._sample_size:
+                h.update(f.read())
+            else:
+                for offset in (0, size // 2, size - self._sample_size):
+                    f.seek(offset)
+                    h.update(f.read(self._sample_size))
+        return h.hexdigest()
+
+    def _full_hash(self, path):
+        h = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1048576), b''):
+                h.update(block)
+        return h.hexdigest()
+
+    def update(self, paths):
+        """Index the provided paths in the background, hashing only files
+        that are new or whose size or modification time changed.  Until then
+        files already indexed keep their content ID and the others have none,
+        so they count as unique.  is_changed() returns true once hashing
+        changed which files are duplicates of each other.
+        """
+        if not self._enabled:
+            return
+        paths = list(paths)
+        entries = {}
+        complete = True
+        with self._lock:
+            for path in paths:
+                entry = self._current_entry(path)
+                if entry is None:
+                    complete = False
+                else:
+                    entries[path] = entry
+            # Entries of files no longer listed are pruned in the background.
+            complete = complete and len(self._index) == len(entries)
+            # Any background pass still queued is for an older list.
+            self._generation += 1
+            generation = self._generation
+        ids, complete_ids = self._assign_ids(entries, hash_full=False)
+        self._publish(paths, ids)
+        if complete and complete_ids:
+            return
+        with self._lock:
+            if self._pool is not None:
+                self._pool.submit(self._index_paths, paths, generation)
+
+    def _current_entry(self, path):
+        """Return the index entry of path if it matches the file on disk,
+        or None.  Must be called with the lock held.
+        """
+        entry = self._index.get(path)
+        if entry is None:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if entry['size'] != st.st_size or entry['mtime'] != st.st_mtime:
+            return None
+        return entry
+
+    def _index_paths(self, paths, generation):
+        """Hash new and changed files, drop index entries for files that are
+        gone, and publish the new content IDs.
+        """
+        try:
+            entries = {}
+            for path in dict.fromkeys(paths):
+                if generation != self._generation:
+                    # A newer update() superseded this one.
+                    return
+                with self._lock:
+                    entry = self._current_entry(path)
+                if entry is None:
+                    try:
+                        st = os.stat(path)
+                        entry = {'size': st.st_size, 'mtime': st.st_mtime,
+                                 'sample': self._sample_hash(path,
+                                                             st.st_size),
+                                 'full': None}
+                    except (IOError, OSError):
+                        continue
+                # Work on a copy, the index is saved from other threads.
+                entries[path] = dict(entry)
+            ids, _ = self._assign_ids(entries, hash_full=True)
+            if generation != self._generation:
+                return
+            with self._lock:
+                self._index = entries
+            if self._publish(paths, ids):
+                self._changed = True
+            self._save_index()
+        except Exception as e:
+            self._log('Failed to index movie files: {0}'.format(e))
+
+    def _assign_ids(self, entries, hash_full):
+        """Return a dictionary of content IDs by path for the indexed
+        entries, and whether every entry got one.  Files sharing a sampled
+        hash are told apart by their full hash, computed only when hash_full
+        is true.  Files without a known full hash get no content ID.
+        """
+        groups = {}
+        for path, entry in entries.items():
+            groups.setdefault(entry['sample'], []).append(path)
+        ids = {}
+        complete = True
+        for sample, group in groups.items():
+            if len(group) > 1 and len(set(os.path.realpath(p)
+                                          for p in group)) > 1:
+                fulls = {}
+                for path in group:
+                    entry = entries[path]
+                    if entry['full'] is None and hash_full:
+                        try:
+                            entry['full'] = self._full_hash(path)
+                        except (IOError, OSError):
+                            pass
+                    if entry['full'] is None:
+                        # Unhashed files are kept apart from the others
+                        # since their content is unknown.
+                        complete = False
+                        continue
+                    fulls[path] = entry['full']
+                if len(set(fulls.values())) > 1:
+                    # Sampling collision: different content, so fall back
+                    # to the full hash as the content ID.
+                    ids.update(fulls)
+                    continue
+                group = list(fulls)
+            for path in group:
+                ids[path] = sample
+        return ids, complete
+
+    def _publish(self, paths, ids):
+        """Switch to the provided content IDs and return true if the groups
+        of duplicate files changed, meaning the playlist built from the
+        previous IDs would now play or skip different files.
+        """
+        sources = {}
+        for path in dict.fromkeys(paths):
+            if path in ids:
+                sources.setdefault(ids[path], []).append(path)
+        with self._lock:
+            old_sources = self._sources
+            self._ids = ids
+            self._sources = sources
+        groups = set(tuple(s) for s in sources.values() if len(s) > 1)
+        if groups == set(tuple(s) for s in old_sources.values()
+                         if len(s) > 1):
+            return False
+        duplicates = sum(len(s) - 1 for s in groups)
+        if duplicates:
+            self._log('Found {0} duplicate movie file{1}.'
+                      .format(duplicates, 's' if duplicates >= 2 else ''))
+        return True
+
+    def is_changed(self):
+        """Return true once after background hashing found new duplicate
+        files or told apart files thought to be duplicates, so the playlist
+        is rebuilt with the new IDs.
+        """
+        if self._changed:
+            self._changed = False
+            return True
+        return False
+
+    def stop(self):
+        """Stop indexing without waiting for running hashes to finish."""
+        with self._lock:
+            self._generation += 1
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    def content_id(self, path):
+        """Return the content ID of an indexed path, or None if unknown."""
+        with self._lock:
+            return self._ids.get(path)
+
+    def sources(self, content_id):
+        """Return the list of paths holding the content."""
+        with self._lock:
+            return list(self._sources.get(content_id, []))
+
+    def unique(self, paths):
+        """Index the paths and return them with copies of the same content
+        removed, keeping the first path for each content.  A path listed more
+        than once (like a playlist repeating a movie) is kept every time.
+        """
+        self.update(paths)
+        chosen = {}
+        movies = []
+        for path in paths:
+            content_id = self.content_id(path)
+            if content_id is None:
+                movies.append(path)
+                continue
+            if chosen.setdefault(content_id, path) == path:
+                movies.append(path)
+        return movies
@@ -35,6 +35,22 @@ class Playlist:
 
         return self._movies[self._index]
 
+    def candidates(self):
+        """Iterate over every movie in the playlist once, starting with the
+        next one and in a random order for random playlists, so movies that
+        can't play right now can be skipped without missing any.  Each movie
+        returned becomes the current one like with get_next().
+        """
+        if self._is_random:
+            order = list(range(len(self._movies)))
+            random.shuffle(order)
+            for index in order:
+                self._index = index
+                yield self._movies[index]
+        else:
+            for i in range(len(self._movies)):
+                yield self.get_next()
+
     def length(self):
         """Return the number of movies in the playlist."""
         return len(self._movies)
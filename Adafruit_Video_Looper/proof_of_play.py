@@ -0,0 +1,276 @@
+import argparse
+import configparser
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+
+# Every play is stored as a fixed size little endian record: item ID (numbered
+# from 1 in order of first play, see the items file), start and end timestamps
+# in seconds since the epoch, and the outcome of the play.
+RECORD = struct.Struct('<IddB3x')
+
+COMPLETED = 0
+FAILED = 1
+STOPPED = 2
+OUTCOMES = {COMPLETED: 'completed', FAILED: 'failed', STOPPED: 'stopped'}
+
+ITEMS_FILE = 'items.txt'
+SEGMENT_PREFIX = 'pop-'
+SEGMENT_SUFFIX = '.bin'
+
+
+def list_segments(path):
+    """Return a sorted list of (first end timestamp, file path) for every
+    segment in the journal directory.
+    """
+    segments = []
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return segments
+    for name in names:
+        if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+            try:
+                start = int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+            except ValueError:
+                continue
+            segments.append((start, os.path.join(path, name)))
+    return sorted(segments)
+
+
+def load_items(path):
+    """Return a dictionary of item ID to movie path for the journal."""
+    items = {}
+    try:
+        with open(os.path.join(path, ITEMS_FILE), 'r') as items_file:
+            for line in items_file:
+                id_string, sep, movie = line.rstrip('\n').partition('\t')
+                if sep:
+                    items[int(id_string)] = movie
+    except (IOError, OSError, ValueError):
+        pass
+    return items
+
+
+class ProofOfPlayLog(object):
+
+    def __init__(self, config, log=print):
+        """Create an instance of an append-only proof-of-play journal.  Plays
+        are queued from the main loop and written in batches by a background
+        thread so the SD card is touched once per flush interval at most.
+        """
+        self._log = log
+        self._queue = queue.Queue()
+        self._thread = None
+        self._segment_path = None
+        self._segment_start = 0
+        self._segment_records = 0
+        self._load_config(config)
+        if not self._enabled:
+            return
+        try:
+            os.makedirs(self._path, exist_ok=True)
+            items = load_items(self._path)
+            self._ids = dict((movie, i) for i, movie in items.items())
+            self._next_id = max(items, default=0) + 1
+            segments = list_segments(self._path)
+            if segments:
+                self._segment_start, self._segment_path = segments[-1]
+                size = os.path.getsize(self._segment_path)
+                # Drop a partial record left by a power cut so the records
+                # appended from now on stay aligned.
+                if size % RECORD.size:
+                    size -= size % RECORD.size
+                    os.truncate(self._segment_path, size)
+                self._segment_records = size // RECORD.size
+        except (IOError, OSError) as e:
+            self._log('Failed to open proof-of-play journal, disabling it: '
+                      '{0}'.format(e))
+            return
+        self._thread = threading.Thread(target=self._writer)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _load_config(self, config):
+        section = 'proof_of_play'
+        self._enabled = config.getboolean(section, 'enabled', fallback=True)
+        self._path = config.get(section, 'path',
+                                fallback='/home/wattah/.kiosk/proof_of_play')
+        self._flush_interval = config.getfloat(section, 'flush_interval',
+                                               fallback=60.0)
+        self._segment_max_records = config.getint(
+            section, 'segment_records', fallback=100000)
+        self._segment_seconds = config.getfloat(section, 'segment_seconds',
+                                                fallback=86400.0)
+
+    def is_enabled(self):
+        """Return true if plays are being journaled."""
+        return self._thread is not None
+
+    def record(self, movie, start, end, outcome):
+        """Queue a play of movie for writing.  Never blocks."""
+        if self._thread is not None:
+            self._queue.put_nowait((movie, start, end, outcome))
+
+    def stop(self):
+        """Write out everything still queued and stop the writer thread."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(5)
+            self._thread = None
+
+    def _writer(self):
+        pending = []
+        flush_at = time.time() + self._flush_interval
+        while True:
+            try:
+                play = self._queue.get(timeout=max(0, flush_at - time.time()))
+            except queue.Empty:
+                play = False
+            if play is None:
+                self._flush(pending)
+                return
+            if play:
+                pending.append(play)
+            if time.time() >= flush_at:
+                self._flush(pending)
+                pending = []
+                flush_at = time.time() + self._flush_interval
+
+    def _flush(self, plays):
+        """Append plays to the journal and fsync them to disk."""
+        if not plays:
+            return
+        try:
+            # Number new movies, keeping the IDs only once they are in the
+            # items file so records never refer to an unknown ID.
+            new_ids = {}
+            for movie, start, end, outcome in plays:
+                if movie not in self._ids and movie not in new_ids:
+                    new_ids[movie] = self._next_id + len(new_ids)
+            if new_ids:
+                with open(os.path.join(self._path, ITEMS_FILE), 'a') \
+                        as items_file:
+                    items_file.writelines('{0}\t{1}\n'.format(i, movie)
+                                          for movie, i in new_ids.items())
+                    items_file.flush()
+                    os.fsync(items_file.fileno())
+                self._ids.update(new_ids)
+                self._next_id += len(new_ids)
+            # Records are grouped by segment so a batch spanning a rotation
+            # still ends up in the right files.
+            data = bytearray()
+            for movie, start, end, outcome in plays:
+                if self._should_rotate(end):
+                    self._write_segment(data)
+                    data = bytearray()
+                    self._segment_start = int(end)
+                    self._segment_path = os.path.join(
+                        self._path, '{0}{1}{2}'.format(
+                            SEGMENT_PREFIX, self._segment_start,
+                            SEGMENT_SUFFIX))
+                    self._segment_records = 0
+                data += RECORD.pack(self._ids[movie], start, end, outcome)
+                self._segment_records += 1
+            self._write_segment(data)
+        except (IOError, OSError) as e:
+            self._log('Failed to write proof-of-play journal: {0}'.format(e))
+
+    def _should_rotate(self, end):
+        return self._segment_path is None or \
+            self._segment_records >= self._segment_max_records or \
+            end - self._segment_start >= self._segment_seconds
+
+    def _write_segment(self, data):
+        if not data:
+            return
+        with open(self._segment_path, 'ab') as segment:
+            segment.write(data)
+            segment.flush()
+            os.fsync(segment.fileno())
+
+
+def summarise(path, start=None, end=None):
+    """Return a dictionary of movie path to play counts per outcome and total
+    seconds played, for plays that ended between start and end.  Segments
+    outside the range are skipped without being read.
+    """
+    if start is None:
+        start = 0
+    if end is None:
+        end = float('inf')
+    items = load_items(path)
+    summary = {}
+    segments = list_segments(path)
+    for i, (segment_start, segment_path) in enumerate(segments):
+        # A segment holds plays that ended before the next segment started.
+        if segment_start > end:
+            break
+        if i + 1 < len(segments) and segments[i + 1][0] < start:
+            continue
+        with open(segment_path, 'rb') as segment:
+            data = segment.read()
+        data = data[:len(data) - len(data) % RECORD.size]
+        for movie_id, play_start, play_end, outcome in \
+                RECORD.iter_unpack(data):
+            if play_end < start or play_end > end:
+                continue
+            movie = items.get(movie_id, '#{0}'.format(movie_id))
+            counts = summary.get(movie)
+            if counts is None:
+                counts = dict((name, 0) for name in OUTCOMES.values())
+                counts['seconds'] = 0.0
+                summary[movie] = counts
+            counts[OUTCOMES.get(outcome, 'failed')] += 1
+            counts['seconds'] += play_end - play_start
+    return summary
+
+
+def _parse_time(value):
+    """Parse a timestamp given as seconds since the epoch or local time in
+    YYYY-MM-DD or YYYY-MM-DD HH:MM format.
+    """
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for fmt in ('%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return time.mktime(time.strptime(value, fmt))
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError('invalid time: {0}'.format(value))
+
+
+# Main entry point to summarise the journal.
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Summarise proof-of-play counts per movie.')
+    parser.add_argument('--config', default='/boot/video_looper.ini',
+                        help='video looper configuration file')
+    parser.add_argument('--path', help='journal directory (overrides config)')
+    parser.add_argument('--from', dest='start', type=_parse_time,
+                        help='only plays ending at or after this time')
+    parser.add_argument('--to', dest='end', type=_parse_time,
+                        help='only plays ending at or before this time')
+    args = parser.parse_args()
+    path = args.path
+    if path is None:
+        config = configparser.ConfigParser()
+        config.read(args.config)
+        path = config.get('proof_of_play', 'path',
+                          fallback='/home/wattah/.kiosk/proof_of_play')
+    summary = summarise(path, args.start, args.end)
+    if not summary:
+        print('No plays found.')
+        sys.exit(0)
+    print('{0:>9} {1:>6} {2:>7} {3:>10}  {4}'.format(
+        'completed', 'failed', 'stopped', 'seconds', 'movie'))
+    for movie in sorted(summary):
+        counts = summary[movie]
+        print('{0:>9} {1:>6} {2:>7} {3:>10.0f}  {4}'.format(
+            counts['completed'], counts['failed'], counts['stopped'],
+            counts['seconds'], movie))
@@ -0,0 +1,340 @@
+# Soak test harness for the video looper.
+#
+# Runs VideoLooper headlessly for days of virtual time in a few minutes, to
+# find slow leaks before they show up on units that run for months:
+#
+#   python3 -m Adafruit_Video_Looper.soak --days 7 --minutes 5
+#
+# - Time is compressed by patching the time module used by the looper with a
+#   VirtualClock: virtual time runs speedup times faster than real time and
+#   every sleep is shortened accordingly.
+#
+# - This module is also a video player and file reader module (see the top of
+#   video_looper.py) so the looper loads the mock player and reader below
+#   through its normal configuration.
+#
+# - A feeder thread rewrites the ticker file and writes messages to the message
+#   pipe, and the playlist is rebuilt regularly.
+#
+# - Memory is sampled with tracemalloc and the process RSS.  Growth after the
+#   warm up is reported by call site and the run fails when it goes over the
+#   threshold.
+import argparse
+import configparser
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+# The clock shared with the mock player and reader, set by SoakTest.
+_clock = None
+
+
+class VirtualClock(object):
+    """Stand-in for the time module running speedup times faster than real
+    time.  Sleeps are shortened but never below min_sleep real seconds so
+    tight loops don't starve the other threads.
+    """
+
+    def __init__(self, speedup, min_sleep=0.0005):
+        self._speedup = speedup
+        self._min_sleep = min_sleep
+        self._real_start = time.monotonic()
+        self._virtual_start = time.time()
+
+    def elapsed(self):
+        """Return the virtual seconds elapsed since the clock was created."""
+        return (time.monotonic() - self._real_start) * self._speedup
+
+    def time(self):
+        return self._virtual_start + self.elapsed()
+
+    def monotonic(self):
+        return self.elapsed()
+
+    def sleep(self, seconds):
+        time.sleep(max(self._min_sleep, seconds / self._speedup))
+
+    def localtime(self, seconds=None):
+        return time.localtime(self.time() if seconds is None else seconds)
+
+    def __getattr__(self, name):
+        # Everything else (strftime, struct_time...) comes from time.
+        return getattr(time, name)
+
+
+class MockPlayer(object):
+    """Video player that pretends to play each movie for its configured
+    duration.  Movies with 'broken' in their name exit right away.
+    """
+
+    def __init__(self, config):
+        self._extensions = ['mp4']
+        self._duration = config.getfloat('soak', 'movie_duration',
+                                         fallback=30.0)
+        self._ends_at = None
+        self.plays = 0
+
+    def supported_extensions(self):
+        return self._extensions
+
+    def play(self, movie, loop=False, vol=0):
+        self.plays += 1
+        if 'broken' in os.path.basename(movie):
+            self._ends_at = _clock.time()
+        else:
+            self._ends_at = _clock.time() + self._duration
+
+    def is_playing(self):
+        return self._ends_at is not None and _clock.time() < self._ends_at
+
+    def stop(self, block_timeout_sec=0):
+        self._ends_at = None
+
+
+class MockReader(object):
+    """File reader over a temporary directory that reports a change every
+    rebuild_interval virtual seconds to exercise playlist rebuilds.
+    """
+
+    def __init__(self, config):
+        self._path = config.get('directory', 'path')
+        self._interval = config.getfloat('soak', 'rebuild_interval',
+                                         fallback=3600.0)
+        self._next_change = None
+
+    def search_paths(self):
+        return [self._path]
+
+    def is_changed(self):
+        now = _clock.time()
+        if self._next_change is None:
+            self._next_change = now + self._interval
+        if now >= self._next_change:
+            self._next_change = now + self._interval
+            return True
+        return False
+
+    def idle_message(self):
+        return 'No files found in {0}'.format(self._path)
+
+
+def create_player(config):
+    """Create new mock video player for soak tests."""
+    return MockPlayer(config)
+
+
+def create_file_reader(config):
+    """Create new mock file reader for soak tests."""
+    return MockReader(config)
+
+
+def _rss():
+    """Return the resident set size of the process in bytes, or 0 if it
+    can't be read.
+    """
+    try:
+        with open('/proc/self/statm', 'r') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        return 0
+
+
+class SoakTest(object):
+
+    def __init__(self, config_path, days, minutes, warmup=0.1,
+                 samples=20, top=10, threshold=1048576):
+        """Create a soak test running the looper for days of virtual time in
+        about minutes of real time.  Memory growth after the first warmup
+        fraction of the run above threshold bytes fails the test.
+        """
+        self._config_path = config_path
+        self._virtual_seconds = days * 86400.0
+        self._real_seconds = minutes * 60.0
+        self._warmup = warmup
+        self._samples = samples
+        self._top = top
+        self._threshold = threshold
+        self._dir = tempfile.mkdtemp(prefix='video_looper_soak_')
+        self._samples_taken = []
+
+    def _write_config(self):
+        """Write a copy of the configuration using the mock player and reader
+        and keeping every file the looper writes inside the temporary
+        directory.
+        """
+        config = configparser.ConfigParser()
+        config.read(self._config_path)
+        movies = os.path.join(self._dir, 'movies')
+        os.makedirs(movies)
+        for name in ('one.mp4', 'two.mp4', 'three.mp4', 'broken.mp4'):
+            with open(os.path.join(movies, name), 'wb') as f:
+                f.write(os.urandom(4096))
+        values = {
+            'video_looper': {'video_player': 'soak', 'file_reader': 'soak',
+                             'osd': 'false', 'keyboard_control': 'false',
+                             'console_output': 'false', 'overlays': ''},
+            'directory': {'path': movies},
+            'soak': {'movie_duration': '30', 'rebuild_interval': '3600'},
+            'failure_tracker': {'status_path':
+                                os.path.join(self._dir, 'status.json')},
+            'media_probe': {'enabled': 'false'},
+            'media_store': {'index_path':
+                            os.path.join(self._dir, 'media_store.json')},
+            'proof_of_play': {'path': os.path.join(self._dir, 'pop'),
+                              'flush_interval': '1'},
+            'log': {'path': os.path.join(self._dir, 'video_looper.log'),
+                    'dump_path': os.path.join(self._dir, 'log.json')},
+            'content_sync': {'enabled': 'false'},
+            # Report stalls instead of exiting the whole soak run.
+            'heartbeat': {'status_path':
+                          os.path.join(self._dir, 'heartbeats.json'),
+                          'stall_action': 'log'},
+        }
+        for section, options in values.items():
+            if not config.has_section(section):
+                config.add_section(section)
+            for option, value in options.items():
+                config.set(section, option, value)
+        path = os.path.join(self._dir, 'video_looper.ini')
+        with open(path, 'w') as config_file:
+            config.write(config_file)
+        return path
+
+    def _feed(self, looper):
+        """Rewrite the ticker every virtual minute and send a message to the
+        message pipe every virtual ten minutes.
+        """
+        messages_at = 0
+        pipe = None
+        while looper._running:
+            with open(looper._ticker_path + '.tmp', 'w') as ticker:
+                for i in range(random.randint(1, 5)):
+                    ticker.write('Headline {0}\n'.format(random.random()))
+            os.replace(looper._ticker_path + '.tmp', looper._ticker_path)
+            if _clock.time() >= messages_at:
+                messages_at = _clock.time() + 600
+                if pipe is None:
+                    try:
+                        pipe = os.open(looper._message_pipe_path,
+                                       os.O_WRONLY | os.O_NONBLOCK)
+                    except OSError:
+                        pass
+                if pipe is not None:
+                    os.write(pipe, json.dumps({
+                        'time_elapse': 60, 'message_type': 'error',
+                        'content': 'Error {0}'.format(random.random())})
+                        .encode('utf-8'))
+            _clock.sleep(60)
+
+    def _sample(self):
+        """Record traced memory, RSS and thread count at the current virtual
+        time, and return the tracemalloc snapshot.
+        """
+        snapshot = tracemalloc.take_snapshot()
+        traced = tracemalloc.get_traced_memory()[0]
+        self._samples_taken.append((_clock.elapsed(), traced, _rss(),
+                                    threading.active_count()))
+        return snapshot
+
+    def run(self):
+        """Run the soak test, print a report and return true if memory
+        growth stayed under the threshold.
+        """
+        global _clock
+        _clock = VirtualClock(self._virtual_seconds / self._real_seconds)
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
+        import pygame.freetype
+        from Adafruit_Video_Looper import failure_tracker, soak, video_looper
+        for module in (video_looper, failure_tracker):
+            module.time = _clock
+        # The looper loads this module again by name when run with -m.
+        soak._clock = _clock
+        # Fall back to the default font when the kiosk fonts aren't installed.
+        font = pygame.freetype.Font
+        pygame.freetype.Font = lambda path, size: font(
+            path if os.path.exists(path) else None, size)
+        tracemalloc.start()
+        looper = video_looper.VideoLooper(self._write_config())
+        looper._ticker_path = os.path.join(self._dir, 'ticker.txt')
+        looper._message_pipe_path = os.path.join(self._dir, 'message_pipe')
+        main = threading.Thread(target=looper.run)
+        main.daemon = True
+        main.start()
+        feeder = threading.Thread(target=self._feed, args=(looper,))
+        feeder.daemon = True
+        feeder.start()
+        interval = self._virtual_seconds / self._samples
+        baseline = None
+        next_sample = interval
+        died = False
+        while _clock.elapsed() < self._virtual_seconds:
+            if not main.is_alive():
+                print('Looper main loop died.')
+                died = True
+                break
+            if _clock.elapsed() >= next_sample:
+                snapshot = self._sample()
+                if baseline is None and \
+                        _clock.elapsed() >= self._virtual_seconds * \
+                        self._warmup:
+                    baseline = snapshot
+                next_sample += interval
+            time.sleep(0.1)
+        final = self._sample()
+        plays = looper._player.plays
+        looper.quit()
+        pygame.freetype.Font = font
+        tracemalloc.stop()
+        if baseline is None:
+            baseline = final
+        return self._report(baseline, final, plays) and not died
+
+    def _report(self, baseline, final, plays):
+        print('Virtual days run: {0:.2f}, movies played: {1}'.format(
+            self._samples_taken[-1][0] / 86400.0, plays))
+        print('{0:>10} {1:>12} {2:>12} {3:>8}'.format('hours', 'traced',
+                                                       'rss', 'threads'))
+        for elapsed, traced, rss, threads in self._samples_taken:
+            print('{0:>10.1f} {1:>12} {2:>12} {3:>8}'.format(
+                elapsed / 3600.0, traced, rss, threads))
+        stats = final.compare_to(baseline, 'lineno')
+        print('Top allocation growth by call site after warm up:')
+        for stat in stats[:self._top]:
+            print('  {0}'.format(stat))
+        growth = sum(stat.size_diff for stat in stats)
+        threads = self._samples_taken[-1][3] - self._samples_taken[0][3]
+        print('Traced memory growth: {0} bytes (threshold {1}), thread '
+              'count growth: {2}'.format(growth, self._threshold, threads))
+        shutil.rmtree(self._dir, ignore_errors=True)
+        if growth > self._threshold or threads > 0:
+            print('FAILED')
+            return False
+        print('PASSED')
+        return True
+
+
+# Main entry point.
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Soak test the video looper with a virtual clock.')
+    parser.add_argument('--config', default=os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        'video_looper.ini'), help='base video looper configuration file')
+    parser.add_argument('--days', type=float, default=7,
+                        help='virtual days to run')
+    parser.add_argument('--minutes', type=float, default=5,
+                        help='real minutes to run them in')
+    parser.add_argument('--threshold', type=int, default=1048576,
+                        help='maximum traced memory growth in bytes')
+    parser.add_argument('--top', type=int, default=10,
+                        help='number of call sites to report')
+    args = parser.parse_args()
+    soak = SoakTest(args.config, args.days, args.minutes, top=args.top,
+                    threshold=args.threshold)
+    sys.exit(0 if soak.run() else 1)
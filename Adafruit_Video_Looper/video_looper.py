@@ -10,14 +10,20 @@ import re
 import signal
 import subprocess
 import sys
-import threading
 import time
 
 import pygame
 import pygame.freetype
 
+from Adafruit_Video_Looper.content_sync import ContentSync
+from Adafruit_Video_Looper.failure_tracker import FailureTracker
+from Adafruit_Video_Looper.heartbeat import HeartbeatRegistry
+from Adafruit_Video_Looper.log import AsyncLog
+from Adafruit_Video_Looper.media_probe import MediaProber
+from Adafruit_Video_Looper.media_store import MediaStore
 from Adafruit_Video_Looper.model import Playlist
 from Adafruit_Video_Looper.overlay import Overlay
+from Adafruit_Video_Looper import proof_of_play
 os.environ["SDL_VIDEODRIVER"] = "dummy"
 # Basic video looper architecure:
 #
@@ -57,6 +63,9 @@ class VideoLooper:
             is the application properly installed?'.format(config_path))
         self._console_output = self._config.getboolean(
             'video_looper', 'console_output')
+        # Log through a background writer so the main and render threads
+        # never block on console or file output.
+        self._log = AsyncLog(self._config, self._console_output)
         # Load configured video player and file reader modules.
         self._player = self._load_player()
         self._reader = self._load_file_reader()
@@ -100,7 +109,9 @@ class VideoLooper:
                        .translate(str.maketrans('', '', ' \t\r\n.')) \
                        .split(',')
         for overlay in overlays:
-            self._overlays.append(Overlay(self._config, overlay))
+            # Skip empty names so overlays can be left empty to disable them.
+            if overlay:
+                self._overlays.append(Overlay(self._config, overlay))
         for overlay in self._overlays:
             overlay.display()
         # Set other static internal state.
@@ -113,15 +124,45 @@ class VideoLooper:
         self._big_font = pygame.freetype.Font(
             "{}/.fonts/LibreFranklin-Regular.ttf".format(home), 250)
         self._ticker_path = '/run/shm/ticker.txt'
+        self._message_pipe_path = '/run/shm/message_pipe'
         self._ticker_received_at = 0
         self._running_text_type = "ticker"
+        self._error_content = ""
         self._lines = self._get_ticker_lines()
+        # Track movies that make the player exit right away so a playlist of
+        # missing or corrupt files doesn't respawn the player in a tight loop.
+        self._failures = FailureTracker(self._config)
+        self._current_movie = None
+        self._movie_started_at = 0
+        # When no movie can be played, the time to look for one again.
+        self._idle_until = 0
+        # Index movie files by content so copies of the same movie are played,
+        # probed and tracked once.
+        self._store = MediaStore(self._config, self._print)
+        # Set when the media store found new duplicates, the playlist is then
+        # rebuilt when the current movie ends.
+        self._rebuild_at_next_movie = False
+        # Probe movie files in the background to keep truncated or
+        # unsupported files out of the playlist.
+        self._prober = MediaProber(self._config, self._print, self._store)
+        # Journal every play for advertisers.
+        self._proof_of_play = proof_of_play.ProofOfPlayLog(self._config,
+                                                           self._print)
+        # Pull new content from the origin server in the background.
+        self._sync = ContentSync(self._config, self._print)
+        # Supervise the background threads so a crashed or blocked one is
+        # noticed instead of silently freezing the clock or ticker.
+        # Stop the player before exiting, the player started after a respawn
+        # doesn't know about it and both would play at once.
+        self._heartbeats = HeartbeatRegistry(self._config, self._print,
+                                             self._player.stop)
         self._running = True
 
-    def _print(self, message):
-        """Print message to standard output if console output is enabled."""
-        if self._console_output:
-            print(message)
+    def _print(self, message, level='info', **fields):
+        """Log message, it is also printed to standard output if console
+        output is enabled.
+        """
+        self._log.log(message, level, **fields)
 
     def _load_player(self):
         """Load the configured video player and return an instance of it."""
@@ -155,7 +196,8 @@ class VideoLooper:
             with open(paths[0], 'r') as playlist_file:
                 movies.extend(f.strip() for f in playlist_file)
             # Create a playlist with the list of movies.
-            return Playlist(movies, self._is_random)
+            return Playlist(self._prober.check(self._store.unique(movies)),
+                            self._is_random)
         for ex in self._extensions:
             for path in paths:
                 # Skip paths that don't exist or are files.
@@ -177,7 +219,8 @@ class VideoLooper:
                         if self._is_number(sound_vol_string):
                             self._sound_vol = int(float(sound_vol_string))
         # Create a playlist with the sorted list of movies.
-        return Playlist(sorted(movies), self._is_random)
+        return Playlist(self._prober.check(self._store.unique(sorted(movies))),
+                        self._is_random)
 
     def _blank_screen(self):
         """Render a blank screen filled with the background color."""
@@ -243,6 +286,7 @@ class VideoLooper:
 
     def _clock(self):
         while self._running:
+            self._heartbeats.beat('clock')
             localtime = time.localtime(time.time())
             hour = localtime.tm_hour
             minute = localtime.tm_min
@@ -303,7 +347,8 @@ class VideoLooper:
             endX = displayLength + labelWidth
             x1 = 210
             x2 = startX
-            while not self._should_update_running_text():
+            while self._running and not self._should_update_running_text():
+                self._heartbeats.beat('running_text')
                 textSurface.fill(self._botbgcolor)
                 textSurface.blit(label, (0, x1))
                 textSurface.blit(label, (0, x2))
@@ -319,30 +364,87 @@ class VideoLooper:
                 x2 = x2 + 7
 
     def _message_pipe(self):
-        pipe_path = "/run/shm/message_pipe"
+        pipe_path = self._message_pipe_path
         if not os.path.exists(pipe_path):
             os.mkfifo(pipe_path, 0o666)
         pipe_fd = os.open(pipe_path, os.O_RDONLY | os.O_NONBLOCK)
-        with os.fdopen(pipe_fd) as pipe:
-            while True:
+        # Read bytes: a text mode read fails when a writer keeps the pipe open
+        # without sending anything.
+        with os.fdopen(pipe_fd, 'rb') as pipe:
+            while self._running:
+                self._heartbeats.beat('message_pipe')
                 message = pipe.read()
                 if message:
-                    print("Received: '%s'" % message)
-                    message_dict = json.loads(message)
-                    self._show_message(message_dict)
+                    message = message.decode('utf-8', 'replace')
+                    self._print("Received: '%s'" % message, 'debug')
+                    try:
+                        message_dict = json.loads(message)
+                    except ValueError:
+                        self._print("Ignoring malformed message: '%s'"
+                                    % message, 'error')
+                    else:
+                        if not isinstance(message_dict, dict):
+                            self._print("Ignoring malformed message: '%s'"
+                                        % message, 'error')
+                        elif message_dict.get("message_type") == "log_query":
+                            self._log_query(message_dict)
+                        else:
+                            self._show_message(message_dict)
                 time.sleep(0.5)
 
     def _show_message(self, message):
-        time_elapse = message["time_elapse"]
-        message_type = message["message_type"]
-        content = message["content"]
-        print("time elapse: {0}, message_type: {1}, content: {2}".format(time_elapse, message_type, content))
+        # Anyone can write to the message pipe, so check the message before
+        # using it.
+        try:
+            time_elapse = message["time_elapse"]
+            message_type = message["message_type"]
+            content = message["content"]
+            if isinstance(time_elapse, bool) or \
+                    not isinstance(time_elapse, (int, float)) or \
+                    not 0 <= time_elapse < float('inf'):
+                raise ValueError('invalid time_elapse')
+            if not isinstance(message_type, str) or \
+                    not isinstance(content, str):
+                raise ValueError('invalid message_type or content')
+        except KeyError as e:
+            self._print('Ignoring message without {0}'.format(e), 'error')
+            return
+        except ValueError as e:
+            self._print('Ignoring malformed message: {0}'.format(e), 'error')
+            return
+        self._print("time elapse: {0}, message_type: {1}, content: {2}".format(time_elapse, message_type, content),
+                    time_elapse=time_elapse, message_type=message_type)
         if message_type == "error":
             self._error_content = content
         self._running_text_type = "error"
-        time.sleep(time_elapse)
+        # Keep beating while the message is shown so it isn't taken for a
+        # stalled thread.
+        end = time.time() + time_elapse
+        while self._running and time.time() < end:
+            self._heartbeats.beat('message_pipe')
+            time.sleep(max(0, min(0.5, end - time.time())))
         self._running_text_type = "ticker"
 
+    def _log_query(self, message):
+        """Dump the most recent log records to the configured dump file for
+        remote diagnosis.  The message can set count and level (minimum
+        level).  Anyone can write to the message pipe, so the values are
+        checked and the dump path can't be chosen by the message.
+        """
+        try:
+            count = message.get("count")
+            if count is not None:
+                count = int(count)
+                if count < 0:
+                    raise ValueError('negative count')
+            level = message.get("level")
+            if level is not None and not isinstance(level, str):
+                raise ValueError('invalid level')
+            self._log.dump(count, level)
+        except (TypeError, ValueError) as e:
+            self._print('Ignoring malformed log query: {0}'.format(e),
+                        'error')
+
     def _idle_message(self):
         """Print idle message from file reader."""
         # Print message to console.
@@ -375,18 +477,80 @@ class VideoLooper:
         else:
             self._idle_message()
 
-    def _prepare_background_task(self):
-        thread = threading.Thread(target=self._clock)
-        thread.setDaemon(True)
-        thread.start()
+    def _next_movie(self, playlist):
+        """Return the next movie in the playlist that isn't backed off or
+        quarantined after failing, or found unplayable by the media prober.
+        Returns None if every movie is unavailable.
+        """
+        now = time.time()
+        if now < self._idle_until:
+            return None
+        retry_at = None
+        for movie in playlist.candidates():
+            if not self._prober.is_valid(movie):
+                continue
+            key = self._item_key(movie)
+            if self._failures.is_available(key, now):
+                return movie
+            if retry_at is None or self._failures.retry_at(key) < retry_at:
+                retry_at = self._failures.retry_at(key)
+        if playlist.length() == 0:
+            return None
+        # Nothing can play, so don't scan the playlist again until the first
+        # movie comes out of backoff (or a minute if every movie was found
+        # unplayable by the prober).
+        self._idle_until = retry_at if retry_at is not None else now + 60
+        self._print('No playable movies, waiting {0:.0f}s'
+                    .format(self._idle_until - now), 'warning')
+        self._blank_screen()
+        return None
+
+    def _item_key(self, movie):
+        """Return the key failures are tracked by, the content ID of the movie
+        when known so every copy of a broken file is backed off together.
+        """
+        return self._store.content_id(movie) or movie
 
-        thread2 = threading.Thread(target=self._running_text)
-        thread2.setDaemon(True)
-        thread2.start()
+    def _movie_finished(self, playlist):
+        """Record how the last started movie ended now the player exited on
+        its own.
+        """
+        movie = self._current_movie
+        self._current_movie = None
+        if movie is None:
+            return
+        now = time.time()
+        elapsed = now - self._movie_started_at
+        failed = self._failures.finished(self._item_key(movie), elapsed,
+                                         playlist.length())
+        self._proof_of_play.record(
+            movie, self._movie_started_at, now,
+            proof_of_play.FAILED if failed else proof_of_play.COMPLETED)
+        if failed:
+            if self._failures.is_quarantined(self._item_key(movie)):
+                self._print('Quarantined movie after repeated failures: {0}'
+                            .format(movie), 'error', movie=movie)
+            else:
+                self._print('Player exited after {0:.2f}s, backing off: {1}'
+                            .format(elapsed, movie), 'warning', movie=movie,
+                            elapsed=elapsed)
+
+    def _stop_player(self, block_timeout_sec=0):
+        """Stop the player on purpose so the exit isn't counted as a failure."""
+        self._player.stop(block_timeout_sec)
+        if self._current_movie is not None:
+            self._proof_of_play.record(self._current_movie,
+                                       self._movie_started_at, time.time(),
+                                       proof_of_play.STOPPED)
+        self._current_movie = None
+
+    def _prepare_background_task(self):
+        # Each thread beats with its name, see HeartbeatRegistry.
+        self._heartbeats.start_worker('clock', self._clock)
+        self._heartbeats.start_worker('running_text', self._running_text)
+        self._heartbeats.start_worker('message_pipe', self._message_pipe)
 
-        thread3 = threading.Thread(target=self._message_pipe)
-        thread3.setDaemon(True)
-        thread3.start()
+        self._sync.start()
 
     def run(self):
         """Main program loop.  Will never return!"""
@@ -398,27 +562,50 @@ class VideoLooper:
         while self._running:
             # Load and play a new movie if nothing is playing.
             if not self._player.is_playing():
-                movie = playlist.get_next()
+                self._movie_finished(playlist)
+                if self._rebuild_at_next_movie:
+                    self._rebuild_at_next_movie = False
+                    playlist = self._build_playlist()
+                    self._idle_until = 0
+                # Don't start anything while backing off after every movie
+                # in the playlist failed.
+                if self._failures.global_wait() > 0:
+                    movie = None
+                else:
+                    movie = self._next_movie(playlist)
                 if movie is not None:
                     # Start playing the first available movie.
-                    self._print('Playing movie: {0}'.format(movie))
+                    self._print('Playing movie: {0}'.format(movie),
+                                movie=movie)
+                    # The player loops a single movie by itself, so don't let
+                    # it when every play has to be journaled.
                     self._player.play(
-                        movie, loop=playlist.length() == 1,
+                        movie, loop=playlist.length() == 1 and
+                        not self._proof_of_play.is_enabled(),
                         vol=self._sound_vol)
+                    self._current_movie = movie
+                    self._movie_started_at = time.time()
             # Check for changes in the file search path (like USB drives added)
-            # and rebuild the playlist.
-            if self._reader.is_changed():
-                self._player.stop(3)  # Up to 3 second delay waiting for old
+            # or newly synced content and rebuild the playlist.
+            if self._store.is_changed():
+                # Duplicates changed, the playing movie can finish first.
+                self._rebuild_at_next_movie = True
+            synced = self._sync.is_changed()
+            if self._reader.is_changed() or synced:
+                self._stop_player(3)  # Up to 3 second delay waiting for old
                 # player to stop.
                 # Rebuild playlist and show countdown again (if OSD enabled).
                 playlist = self._build_playlist()
+                self._rebuild_at_next_movie = False
+                self._failures.reset()
+                self._idle_until = 0
                 self._prepare_to_run_playlist(playlist)
             # Event handling for key press, if keyboard control is enabled
             if self._keyboard_control:
                 for event in pygame.event.get():
                     if event.type == pygame.KEYDOWN:
                         if event.key == pygame.K_n:
-                            self._player.stop(1)
+                            self._stop_player(1)
                         # If pressed key is ESC quit program
                         if event.key == pygame.K_ESCAPE:
                             self.quit()
@@ -432,12 +619,18 @@ class VideoLooper:
     def quit(self):
         """Shut down the program"""
         self._running = False
+        self._heartbeats.stop()
         if self._player is not None:
-            self._player.stop()
+            self._stop_player()
+        self._prober.stop()
+        self._store.stop()
+        self._sync.stop()
+        self._proof_of_play.stop()
         for overlay in self._overlays:
             if overlay is not None:
                 overlay.stop()
         pygame.quit()
+        self._log.stop()
 
     def signal_quit(self, signal, frame):
         """Shut down the program, meant to be called by signal handler."""
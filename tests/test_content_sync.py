@@ -0,0 +1,176 @@
+import configparser
+import functools
+import hashlib
+import http.server
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from Adafruit_Video_Looper.content_sync import ContentSync
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    """Plain stand-in origin, like python3 -m http.server: ignores Range."""
+
+    def log_message(self, *args):
+        pass
+
+
+class RangeHandler(QuietHandler):
+    """Stand-in origin answering byte range requests with 206."""
+
+    def do_GET(self):
+        self.server.ranges.append(self.headers.get('Range'))
+        match = re.match(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+        path = self.translate_path(self.path)
+        if match is None or not os.path.isfile(path):
+            return QuietHandler.do_GET(self)
+        with open(path, 'rb') as f:
+            data = f.read()
+        start, end = int(match.group(1)), int(match.group(2))
+        chunk = data[start:end + 1]
+        self.send_response(206)
+        self.send_header('Content-Length', str(len(chunk)))
+        self.end_headers()
+        self.wfile.write(chunk)
+
+
+class ContentSyncTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.origin = os.path.join(self.path, 'origin')
+        self.videos = os.path.join(self.path, 'videos')
+        os.makedirs(self.origin)
+        os.makedirs(self.videos)
+        self.server = None
+
+    def tearDown(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def serve(self, handler):
+        self.server = http.server.ThreadingHTTPServer(
+            ('127.0.0.1', 0), functools.partial(handler,
+                                                directory=self.origin))
+        self.server.ranges = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return 'http://127.0.0.1:{0}/manifest.json'.format(
+            self.server.server_address[1])
+
+    def publish(self, files, bad_hash=()):
+        """Write files (name to bytes) to the origin with a manifest."""
+        entries = []
+        for name, data in files.items():
+            with open(os.path.join(self.origin, name), 'wb') as f:
+                f.write(data)
+            sha256 = hashlib.sha256(data).hexdigest()
+            if name in bad_hash:
+                sha256 = hashlib.sha256(b'other').hexdigest()
+            entries.append({'name': name, 'size': len(data),
+                            'sha256': sha256})
+        with open(os.path.join(self.origin, 'manifest.json'), 'w') as f:
+            json.dump({'files': entries}, f)
+        return entries
+
+    def create_sync(self, url, **options):
+        config = configparser.ConfigParser()
+        config.read_dict({'content_sync': {
+            'enabled': 'true', 'manifest_url': url,
+            'directory': self.videos,
+            'playlist_path': os.path.join(self.path, 'playlist.txt'),
+            'connections': '4', 'chunk_size': '65536', 'bandwidth': '0',
+            'timeout': '10'}})
+        for option, value in options.items():
+            config.set('content_sync', option, str(value))
+        self.messages = []
+        return ContentSync(config, log=self.messages.append)
+
+    def read(self, name):
+        with open(os.path.join(self.videos, name), 'rb') as f:
+            return f.read()
+
+    def test_plain_http_server_origin(self):
+        files = {'big.mp4': os.urandom(200000), 'small.mp4': b'small'}
+        self.publish(files)
+        sync = self.create_sync(self.serve(QuietHandler))
+        sync.sync()
+        self.assertTrue(sync.is_changed())
+        self.assertFalse(sync.is_changed())
+        for name, data in files.items():
+            self.assertEqual(self.read(name), data)
+        with open(os.path.join(self.path, 'playlist.txt')) as playlist:
+            self.assertEqual(
+                [os.path.basename(l.strip()) for l in playlist],
+                ['big.mp4', 'small.mp4'])
+        # Nothing to do the second time.
+        sync.sync()
+        self.assertFalse(sync.is_changed())
+
+    def test_resume_from_partial_range(self):
+        data = os.urandom(200000)
+        entry = self.publish({'movie.mp4': data})[0]
+        sync = self.create_sync(self.serve(RangeHandler))
+        # Pretend an earlier transfer got the first 1000 bytes of the
+        # second range before being interrupted.
+        os.makedirs(os.path.join(self.videos, '.partial'))
+        with open(os.path.join(self.videos, '.partial',
+                               entry['sha256'] + '.1'), 'wb') as part:
+            part.write(data[65536:66536])
+        sync.sync()
+        self.assertEqual(self.read('movie.mp4'), data)
+        self.assertIn('bytes=66536-131071', self.server.ranges)
+        self.assertNotIn('bytes=65536-131071', self.server.ranges)
+        self.assertEqual(os.listdir(os.path.join(self.videos, '.partial')),
+                         ['sync_state.json'])
+
+    def test_hash_mismatch_skips_only_that_file(self):
+        self.publish({'bad.mp4': os.urandom(1000), 'good.mp4': b'good'},
+                     bad_hash=('bad.mp4',))
+        sync = self.create_sync(self.serve(RangeHandler))
+        sync.sync()
+        self.assertFalse(os.path.exists(os.path.join(self.videos,
+                                                     'bad.mp4')))
+        self.assertEqual(self.read('good.mp4'), b'good')
+        self.assertTrue(sync.is_changed())
+        self.assertTrue(any('hash mismatch' in m for m in self.messages))
+        self.assertEqual(os.listdir(os.path.join(self.videos, '.partial')),
+                         ['sync_state.json'])
+
+    def test_invalid_entry_skips_only_that_file(self):
+        self.publish({'good.mp4': b'good'})
+        with open(os.path.join(self.origin, 'manifest.json')) as f:
+            manifest = json.load(f)
+        manifest['files'].insert(0, {'name': '../evil', 'size': 1,
+                                     'sha256': '../../etc'})
+        with open(os.path.join(self.origin, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f)
+        sync = self.create_sync(self.serve(QuietHandler))
+        sync.sync()
+        self.assertEqual(self.read('good.mp4'), b'good')
+        self.assertEqual(sorted(os.listdir(self.videos)),
+                         ['.partial', 'good.mp4'])
+
+    def test_bandwidth_cap(self):
+        data = os.urandom(300000)
+        self.publish({'movie.mp4': data})
+        # The bucket starts full with one second of transfer, so 300000
+        # bytes at 100000 bytes per second take at least two seconds.
+        sync = self.create_sync(self.serve(RangeHandler), bandwidth=100000)
+        start = time.time()
+        sync.sync()
+        self.assertGreaterEqual(time.time() - start, 1.9)
+        self.assertEqual(self.read('movie.mp4'), data)
+
+
+if __name__ == '__main__':
+    unittest.main()
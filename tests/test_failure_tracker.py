@@ -0,0 +1,102 @@
+import configparser
+import unittest
+
+from Adafruit_Video_Looper.failure_tracker import FailureTracker
+
+
+def create_tracker(**options):
+    config = configparser.ConfigParser()
+    config.read_dict({'failure_tracker': {
+        'min_play_time': '2', 'base_backoff': '1', 'max_backoff': '8',
+        'quarantine_after': '5', 'quarantine_retry': '3600',
+        'global_max_backoff': '60', 'status_path': ''}})
+    for option, value in options.items():
+        config.set('failure_tracker', option, str(value))
+    return FailureTracker(config)
+
+
+class FailureTrackerTest(unittest.TestCase):
+
+    def test_long_play_is_not_a_failure(self):
+        tracker = create_tracker()
+        self.assertFalse(tracker.finished('a', 30, 2, now=100))
+        self.assertTrue(tracker.is_available('a', now=100))
+
+    def test_backoff_doubles_up_to_cap(self):
+        tracker = create_tracker(quarantine_after=10)
+        delays = []
+        for i in range(6):
+            now = 1000 * (i + 1)
+            tracker.finished('a', 0.1, 100, now=now)
+            delays.append(tracker.retry_at('a') - now)
+        self.assertEqual(delays, [1, 2, 4, 8, 8, 8])
+
+    def test_backoff_expires(self):
+        tracker = create_tracker()
+        tracker.finished('a', 0.1, 100, now=100)
+        self.assertFalse(tracker.is_available('a', now=100.5))
+        self.assertTrue(tracker.is_available('a', now=101))
+
+    def test_success_resets_backoff(self):
+        tracker = create_tracker()
+        tracker.finished('a', 0.1, 100, now=100)
+        tracker.finished('a', 0.1, 100, now=200)
+        tracker.finished('a', 10, 100, now=300)
+        tracker.finished('a', 0.1, 100, now=400)
+        self.assertEqual(tracker.retry_at('a'), 401)
+
+    def test_quarantine_after_failures(self):
+        tracker = create_tracker()
+        for i in range(4):
+            tracker.finished('a', 0.1, 100, now=100 * (i + 1))
+            self.assertFalse(tracker.is_quarantined('a'))
+        tracker.finished('a', 0.1, 100, now=500)
+        self.assertTrue(tracker.is_quarantined('a'))
+        self.assertEqual(tracker.status(now=500)['quarantined'], 1)
+
+    def test_quarantine_retry(self):
+        tracker = create_tracker()
+        for i in range(5):
+            tracker.finished('a', 0.1, 100, now=100 * (i + 1))
+        self.assertFalse(tracker.is_available('a', now=500 + 3599))
+        self.assertTrue(tracker.is_available('a', now=500 + 3600))
+        # Still quarantined until it plays properly, and failing again
+        # waits another quarantine_retry.
+        tracker.finished('a', 0.1, 100, now=4100)
+        self.assertEqual(tracker.retry_at('a'), 4100 + 3600)
+        tracker.finished('a', 10, 100, now=8000)
+        self.assertFalse(tracker.is_quarantined('a'))
+
+    def test_global_backoff_only_when_whole_playlist_failed(self):
+        tracker = create_tracker()
+        tracker.finished('a', 0.1, 3, now=100)
+        tracker.finished('b', 0.1, 3, now=100)
+        self.assertEqual(tracker.global_wait(now=100), 0)
+        tracker.finished('c', 0.1, 3, now=100)
+        self.assertEqual(tracker.global_wait(now=100), 1)
+        tracker.finished('a', 0.1, 3, now=200)
+        self.assertEqual(tracker.global_wait(now=200), 2)
+
+    def test_global_backoff_cleared_by_success(self):
+        tracker = create_tracker()
+        tracker.finished('a', 0.1, 1, now=100)
+        self.assertGreater(tracker.global_wait(now=100), 0)
+        tracker.finished('b', 10, 1, now=200)
+        self.assertEqual(tracker.global_wait(now=200), 0)
+
+    def test_global_backoff_cap(self):
+        tracker = create_tracker(quarantine_after=100)
+        for i in range(20):
+            tracker.finished('a', 0.1, 1, now=1000 * (i + 1))
+        self.assertEqual(tracker.global_wait(now=20000), 60)
+
+    def test_reset(self):
+        tracker = create_tracker()
+        tracker.finished('a', 0.1, 1, now=100)
+        tracker.reset()
+        self.assertTrue(tracker.is_available('a', now=100))
+        self.assertEqual(tracker.global_wait(now=100), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
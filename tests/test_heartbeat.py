@@ -0,0 +1,123 @@
+import configparser
+import threading
+import time
+import unittest
+
+from Adafruit_Video_Looper.heartbeat import HeartbeatRegistry
+
+
+class HeartbeatRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.messages = []
+        self.exits = []
+        self.done = threading.Event()
+        self.registries = []
+
+    def tearDown(self):
+        self.done.set()
+        for registry in self.registries:
+            registry.stop()
+
+    def create_registry(self, **options):
+        config = configparser.ConfigParser()
+        config.read_dict({'heartbeat': {
+            'check_interval': '0.02', 'budget': '10', 'stall_action': 'exit',
+            'max_restarts': '2', 'restart_window': '3600',
+            'status_path': ''}})
+        for option, value in options.items():
+            config.set('heartbeat', option, str(value))
+        registry = HeartbeatRegistry(config, log=self.messages.append)
+        # Record exits instead of ending the test process.
+        registry._exit = self.exits.append
+        self.registries.append(registry)
+        return registry
+
+    def wait_for(self, condition, timeout=5):
+        end = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > end:
+                self.fail('timed out')
+            time.sleep(0.01)
+
+    def test_crashed_worker_is_restarted(self):
+        registry = self.create_registry()
+        runs = []
+
+        def target():
+            runs.append(1)
+            if len(runs) == 1:
+                raise RuntimeError('boom')
+            while not self.done.is_set():
+                registry.beat('worker')
+                time.sleep(0.01)
+
+        registry.start_worker('worker', target)
+        self.wait_for(lambda: len(runs) == 2)
+        self.assertEqual(registry.status()['worker']['restarts'], 1)
+        self.assertTrue(any('crashed' in m for m in self.messages))
+        self.assertEqual(self.exits, [])
+
+    def test_exit_after_max_restarts(self):
+        registry = self.create_registry()
+
+        def target():
+            raise RuntimeError('boom')
+
+        registry.start_worker('worker', target)
+        self.wait_for(lambda: self.exits)
+        self.assertEqual(registry.status()['worker']['restarts'], 2)
+        self.assertIn('died 3 times', self.exits[0])
+
+    def test_restarts_outside_window_are_forgotten(self):
+        registry = self.create_registry(max_restarts=1, restart_window=0.1)
+
+        def target():
+            time.sleep(0.2)
+            raise RuntimeError('boom')
+
+        registry.start_worker('worker', target)
+        self.wait_for(lambda: registry.status()['worker']['restarts'] >= 3)
+        self.assertEqual(self.exits, [])
+
+    def test_stall_is_logged_then_recovery(self):
+        registry = self.create_registry(stall_action='log')
+        resume = threading.Event()
+
+        def target():
+            registry.beat('worker')
+            resume.wait()
+            registry.beat('worker')
+            self.done.wait()
+
+        registry.start_worker('worker', target, budget=0.1)
+        self.wait_for(lambda: any('stalled' in m for m in self.messages))
+        resume.set()
+        self.wait_for(lambda: any('recovered' in m for m in self.messages))
+        status = registry.status()['worker']
+        self.assertEqual(status['stalls'], 1)
+        self.assertGreater(status['max_gap'], 0.1)
+        self.assertEqual(self.exits, [])
+
+    def test_stall_exits(self):
+        registry = self.create_registry()
+        registry.start_worker('worker', self.done.wait, budget=0.1)
+        self.wait_for(lambda: self.exits)
+        self.assertIn('Thread worker stalled', self.exits[0])
+
+    def test_histogram_buckets(self):
+        registry = self.create_registry()
+        registry.start_worker('worker', self.done.wait)
+        worker = registry._workers['worker']
+        for gap in (0.01, 0.3, 0.3, 100):
+            worker.last_beat = time.monotonic() - gap
+            registry.beat('worker')
+        histogram = registry.status()['worker']['histogram']
+        self.assertEqual(histogram['<=0.05s'], 1)
+        self.assertEqual(histogram['<=0.5s'], 2)
+        self.assertEqual(histogram['>60s'], 1)
+        self.assertEqual(sum(histogram.values()), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import configparser
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from Adafruit_Video_Looper.log import AsyncLog
+
+
+class BrokenConsole(object):
+
+    def write(self, data):
+        raise BrokenPipeError()
+
+    def flush(self):
+        pass
+
+
+class AsyncLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        config = configparser.ConfigParser()
+        config.read_dict({'log': {
+            'path': os.path.join(self.path, 'video_looper.log'),
+            'dump_path': os.path.join(self.path, 'dump.json'),
+            'ring_size': '5'}})
+        self.config = config
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_recent_filters_by_count_and_level(self):
+        log = AsyncLog(self.config, console_output=False)
+        for i in range(8):
+            log.log('message {0}'.format(i),
+                    'error' if i % 2 else 'info')
+        log.stop()
+        self.assertEqual([r['message'] for r in log.recent()],
+                         ['message {0}'.format(i) for i in range(3, 8)])
+        self.assertEqual([r['message'] for r in log.recent('2', 'error')],
+                         ['message 5', 'message 7'])
+
+    def test_dump_writes_to_configured_path(self):
+        log = AsyncLog(self.config, console_output=False)
+        log.log('hello')
+        log.dump(1)
+        log.stop()
+        with open(os.path.join(self.path, 'dump.json')) as dump_file:
+            dump = json.load(dump_file)
+        self.assertEqual(dump['records'][0]['message'], 'hello')
+
+    def test_console_error_does_not_stop_writer(self):
+        stdout = sys.stdout
+        sys.stdout = BrokenConsole()
+        try:
+            log = AsyncLog(self.config, console_output=True)
+            log.log('first')
+            log.log('second')
+            log.stop()
+        finally:
+            sys.stdout = stdout
+        with open(os.path.join(self.path, 'video_looper.log')) as log_file:
+            messages = [json.loads(line)['message'] for line in log_file]
+        self.assertEqual(messages, ['first', 'second'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import configparser
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from Adafruit_Video_Looper import media_probe
+
+
+def ffprobe_output(returncode=0, video='h264', width=1920, height=1080,
+                   duration='10.0', stderr=b''):
+    """Return a CompletedProcess like ffprobe would for a movie with the
+    provided properties, leaving out the ones set to None.
+    """
+    streams = []
+    if video is not None:
+        stream = {'codec_type': 'video', 'codec_name': video}
+        if width is not None:
+            stream['width'] = width
+        if height is not None:
+            stream['height'] = height
+        streams.append(stream)
+    streams.append({'codec_type': 'audio', 'codec_name': 'aac'})
+    probe = {'streams': streams, 'format': {}}
+    if duration is not None:
+        probe['format']['duration'] = duration
+    return subprocess.CompletedProcess(
+        [], returncode, json.dumps(probe).encode('utf-8'), stderr)
+
+
+class MediaProberTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.path, 'media_probe.json')
+        self.probers = []
+
+    def tearDown(self):
+        for prober in self.probers:
+            prober.stop()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def create_prober(self, **options):
+        config = configparser.ConfigParser()
+        config.read_dict({'media_probe': {
+            'enabled': 'false', 'workers': '2', 'min_interval': '0',
+            'cache_path': self.cache_path, 'video_codecs': 'h264, hevc'}})
+        for option, value in options.items():
+            config.set('media_probe', option, str(value))
+        self.messages = []
+        prober = media_probe.MediaProber(config, log=self.messages.append)
+        self.probers.append(prober)
+        return prober
+
+    def write(self, name, data=b'movie'):
+        path = os.path.join(self.path, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def cache(self, prober, movie, ok=True, error=None):
+        """Store a probe result for the current version of movie."""
+        st = os.stat(movie)
+        prober._results[movie] = {
+            'ok': ok, 'error': error, 'duration': 10.0,
+            'video_codec': 'h264', 'audio_codec': None, 'width': 1920,
+            'height': 1080, 'size': st.st_size, 'mtime': st.st_mtime}
+
+    def test_parse_playable(self):
+        result = self.create_prober()._parse(ffprobe_output())
+        self.assertTrue(result['ok'])
+        self.assertEqual(result['duration'], 10.0)
+        self.assertEqual(result['audio_codec'], 'aac')
+        self.assertEqual((result['width'], result['height']), (1920, 1080))
+
+    def test_parse_failures(self):
+        prober = self.create_prober()
+        for output, error in (
+                (ffprobe_output(video=None), 'no video stream'),
+                (ffprobe_output(video='vp9'), 'unsupported video codec vp9'),
+                (ffprobe_output(duration=None), 'unknown duration'),
+                (ffprobe_output(duration='0'), 'unknown duration'),
+                (ffprobe_output(width=None), 'unknown resolution'),
+                (ffprobe_output(returncode=1, stderr=b'moov atom not found'),
+                 'moov atom not found'),
+                (subprocess.CompletedProcess([], 0, b'garbage', b''),
+                 'unreadable ffprobe output')):
+            result = prober._parse(output)
+            self.assertFalse(result['ok'])
+            self.assertEqual(result['error'], error)
+
+    def test_any_codec_when_none_configured(self):
+        prober = self.create_prober(video_codecs='')
+        self.assertTrue(prober._parse(ffprobe_output(video='vp9'))['ok'])
+
+    def test_check_skips_cached_failure(self):
+        prober = self.create_prober()
+        good = self.write('good.mp4')
+        bad = self.write('bad.mp4')
+        new = self.write('new.mp4')
+        self.cache(prober, good)
+        self.cache(prober, bad, ok=False, error='no video stream')
+        self.assertEqual(prober.check([good, bad, new]), [good, new])
+        self.assertFalse(prober.is_valid(bad))
+        self.assertTrue(prober.is_valid(new))
+
+    def test_cache_invalidated_by_size_and_mtime(self):
+        prober = self.create_prober()
+        movie = self.write('movie.mp4')
+        self.cache(prober, movie, ok=False, error='truncated')
+        self.assertEqual(prober.check([movie]), [])
+        os.utime(movie, (1, 1))
+        self.assertEqual(prober.check([movie]), [movie])
+        self.cache(prober, movie, ok=False, error='truncated')
+        self.write('movie.mp4', b'longer movie')
+        os.utime(movie, (1, 1))
+        self.assertEqual(prober.check([movie]), [movie])
+
+    def test_cache_saved_once_per_batch_and_pruned(self):
+        prober = self.create_prober(enabled='true')
+        movies = [self.write('{0}.mp4'.format(i)) for i in range(5)]
+        old = self.write('old.mp4')
+        self.cache(prober, old)
+        release = threading.Event()
+
+        def run(*args, **kwargs):
+            # Hold the probes until they are all queued.
+            release.wait(5)
+            return ffprobe_output()
+
+        with mock.patch.object(media_probe.subprocess, 'run', run), \
+                mock.patch.object(media_probe.os, 'replace',
+                                  wraps=os.replace) as replace:
+            prober.check(movies)
+            release.set()
+            prober._pool.shutdown(wait=True)
+        self.assertEqual(replace.call_count, 1)
+        with open(self.cache_path, 'r') as cache_file:
+            self.assertEqual(sorted(json.load(cache_file)), sorted(movies))
+        self.assertEqual(prober.duration(movies[0]), 10.0)
+        # Nothing changed, nothing written.
+        with mock.patch.object(media_probe.os, 'replace') as replace:
+            prober.check(movies)
+        self.assertEqual(replace.call_count, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import configparser
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from Adafruit_Video_Looper.media_store import MediaStore
+
+
+class MediaStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.index_path = os.path.join(self.path, 'media_store.json')
+        self.stores = []
+
+    def tearDown(self):
+        for store in self.stores:
+            store.stop()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def create_store(self):
+        config = configparser.ConfigParser()
+        config.read_dict({'media_store': {
+            'enabled': 'true', 'index_path': self.index_path,
+            'sample_size': '4'}})
+        store = MediaStore(config, log=lambda m: None)
+        self.stores.append(store)
+        return store
+
+    def write(self, name, data):
+        path = os.path.join(self.path, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def wait(self, store):
+        """Wait for the queued background indexing to finish."""
+        store._pool.submit(lambda: None).result()
+
+    def test_new_files_are_unique_until_hashed(self):
+        store = self.create_store()
+        a = self.write('a.mp4', b'movie')
+        b = self.write('b.mp4', b'movie')
+        self.assertEqual(store.unique([a, b]), [a, b])
+        self.wait(store)
+        self.assertTrue(store.is_changed())
+        self.assertFalse(store.is_changed())
+        self.assertEqual(store.unique([a, b]), [a])
+        self.assertEqual(store.sources(store.content_id(a)), [a, b])
+        self.wait(store)
+        self.assertFalse(store.is_changed())
+
+    def test_unique_files_dont_signal_change(self):
+        store = self.create_store()
+        a = self.write('a.mp4', b'one')
+        store.update([a])
+        self.wait(store)
+        self.assertFalse(store.is_changed())
+        b = self.write('b.mp4', b'two')
+        store.update([a, b])
+        self.wait(store)
+        self.assertFalse(store.is_changed())
+        self.assertIsNotNone(store.content_id(b))
+
+    def test_repeated_path_is_kept(self):
+        store = self.create_store()
+        a = self.write('a.mp4', b'movie')
+        store.update([a])
+        self.wait(store)
+        self.assertEqual(store.unique([a, a]), [a, a])
+
+    def test_sampled_collision_uses_full_hash(self):
+        # Same size and same bytes at the start, middle and end, so only a
+        # full hash tells them apart.
+        data = bytearray(40)
+        a = self.write('a.mp4', bytes(data))
+        data[10] = 1
+        b = self.write('b.mp4', bytes(data))
+        c = self.write('c.mp4', bytes(data))
+        store = self.create_store()
+        store.update([a, b, c])
+        self.wait(store)
+        self.assertTrue(store.is_changed())
+        self.assertNotEqual(store.content_id(a), store.content_id(b))
+        self.assertEqual(store.content_id(b), store.content_id(c))
+        self.assertEqual(store.unique([a, b, c]), [a, b])
+        # Full hashes are kept, so a restart agrees right away without
+        # reading the files again.
+        store = self.create_store()
+        self.assertEqual(store.unique([a, b, c]), [a, b])
+        self.wait(store)
+        self.assertFalse(store.is_changed())
+
+    def test_changed_file_is_hashed_again(self):
+        store = self.create_store()
+        a = self.write('a.mp4', b'one')
+        b = self.write('b.mp4', b'two')
+        store.update([a, b])
+        self.wait(store)
+        self.assertEqual(store.unique([a, b]), [a, b])
+        self.wait(store)
+        self.assertFalse(store.is_changed())
+        self.write('b.mp4', b'one')
+        os.utime(b, (1, 1))
+        # The changed file loses its stale ID until it is hashed again.
+        self.assertEqual(store.unique([a, b]), [a, b])
+        self.assertIsNone(store.content_id(b))
+        self.wait(store)
+        self.assertTrue(store.is_changed())
+        self.assertEqual(store.unique([a, b]), [a])
+
+    def test_index_is_pruned(self):
+        store = self.create_store()
+        a = self.write('a.mp4', b'one')
+        b = self.write('b.mp4', b'two')
+        c = self.write('c.mp4', b'three')
+        store.update([a, b, c])
+        self.wait(store)
+        os.remove(b)
+        store.update([a, b])
+        self.wait(store)
+        with open(self.index_path, 'r') as index_file:
+            self.assertEqual(list(json.load(index_file)), [a])
+        self.assertIsNone(store.content_id(c))
+
+
+if __name__ == '__main__':
+    unittest.main()
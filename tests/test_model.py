@@ -0,0 +1,33 @@
+import unittest
+
+from Adafruit_Video_Looper.model import Playlist
+
+
+class PlaylistTest(unittest.TestCase):
+
+    def test_candidates_in_order_from_next_movie(self):
+        playlist = Playlist(['a', 'b', 'c'], False)
+        self.assertEqual(playlist.get_next(), 'a')
+        candidates = playlist.candidates()
+        self.assertEqual(next(candidates), 'b')
+        self.assertEqual(playlist.get_next(), 'c')
+        self.assertEqual(list(Playlist(['a', 'b', 'c'], False).candidates()),
+                         ['a', 'b', 'c'])
+
+    def test_random_candidates_visit_every_movie_once(self):
+        for i in range(100):
+            playlist = Playlist(['good', 'bad1', 'bad2'], True)
+            seen = list(playlist.candidates())
+            self.assertEqual(sorted(seen), ['bad1', 'bad2', 'good'])
+
+    def test_random_candidate_becomes_current(self):
+        playlist = Playlist(['a', 'b', 'c'], True)
+        for movie in playlist.candidates():
+            self.assertEqual(playlist._movies[playlist._index], movie)
+
+    def test_empty_playlist_has_no_candidates(self):
+        self.assertEqual(list(Playlist([], True).candidates()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
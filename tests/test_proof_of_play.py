@@ -0,0 +1,130 @@
+import configparser
+import os
+import shutil
+import tempfile
+import unittest
+
+from Adafruit_Video_Looper import proof_of_play
+
+
+def write_segment(path, start, plays):
+    """Write a segment named after start holding (movie, start, end, outcome)
+    plays, and register new movies in the items file.
+    """
+    ids = dict((movie, i) for i, movie in
+               proof_of_play.load_items(path).items())
+    with open(os.path.join(path, proof_of_play.ITEMS_FILE), 'a') as items:
+        for movie in sorted(set(p[0] for p in plays) - set(ids)):
+            ids[movie] = len(ids) + 1
+            items.write('{0}\t{1}\n'.format(ids[movie], movie))
+    with open(os.path.join(path, '{0}{1}{2}'.format(
+            proof_of_play.SEGMENT_PREFIX, start,
+            proof_of_play.SEGMENT_SUFFIX)), 'ab') as segment:
+        for movie, play_start, play_end, outcome in plays:
+            segment.write(proof_of_play.RECORD.pack(
+                ids[movie], play_start, play_end, outcome))
+
+
+class ProofOfPlayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def create_log(self, path=None):
+        config = configparser.ConfigParser()
+        config.read_dict({'proof_of_play': {
+            'path': self.path if path is None else path,
+            'flush_interval': '60'}})
+        return proof_of_play.ProofOfPlayLog(config, log=lambda m: None)
+
+    def test_summarise_counts_outcomes(self):
+        write_segment(self.path, 100, [
+            ('a.mp4', 90, 100, proof_of_play.COMPLETED),
+            ('a.mp4', 100, 101, proof_of_play.FAILED),
+            ('b.mp4', 101, 111, proof_of_play.STOPPED)])
+        summary = proof_of_play.summarise(self.path)
+        self.assertEqual(summary['a.mp4']['completed'], 1)
+        self.assertEqual(summary['a.mp4']['failed'], 1)
+        self.assertEqual(summary['a.mp4']['seconds'], 11)
+        self.assertEqual(summary['b.mp4']['stopped'], 1)
+
+    def test_summarise_filters_by_end_time(self):
+        write_segment(self.path, 100, [
+            ('a.mp4', 90, 100, proof_of_play.COMPLETED),
+            ('a.mp4', 100, 200, proof_of_play.COMPLETED),
+            ('a.mp4', 200, 300, proof_of_play.COMPLETED)])
+        summary = proof_of_play.summarise(self.path, 150, 250)
+        self.assertEqual(summary['a.mp4']['completed'], 1)
+
+    def test_summarise_skips_segments_outside_range(self):
+        # Records are only ever looked up in the segment covering their end
+        # time, so plays stored in segments outside the range aren't read.
+        write_segment(self.path, 100, [
+            ('early.mp4', 500, 500, proof_of_play.COMPLETED)])
+        write_segment(self.path, 200, [
+            ('a.mp4', 200, 300, proof_of_play.COMPLETED)])
+        write_segment(self.path, 400, [
+            ('late.mp4', 300, 300, proof_of_play.COMPLETED)])
+        summary = proof_of_play.summarise(self.path, 250, 350)
+        self.assertEqual(list(summary), ['a.mp4'])
+
+    def test_flush_rotates_segments(self):
+        log = self.create_log()
+        log._segment_max_records = 2
+        log._flush([('a.mp4', i, i + 1, proof_of_play.COMPLETED)
+                    for i in range(5)])
+        log.stop()
+        self.assertEqual(len(proof_of_play.list_segments(self.path)), 3)
+        self.assertEqual(
+            proof_of_play.summarise(self.path)['a.mp4']['completed'], 5)
+
+    def test_torn_record_is_truncated_on_start(self):
+        write_segment(self.path, 100, [
+            ('a.mp4', 90, 100, proof_of_play.COMPLETED)])
+        segment = proof_of_play.list_segments(self.path)[0][1]
+        with open(segment, 'ab') as f:
+            f.write(b'\x01\x02\x03')
+        log = self.create_log()
+        log.record('a.mp4', 100, 110, proof_of_play.COMPLETED)
+        log.stop()
+        self.assertEqual(os.path.getsize(segment),
+                         2 * proof_of_play.RECORD.size)
+        summary = proof_of_play.summarise(self.path)
+        self.assertEqual(list(summary), ['a.mp4'])
+        self.assertEqual(summary['a.mp4']['completed'], 2)
+
+    def test_items_are_numbered_in_order(self):
+        write_segment(self.path, 100, [
+            ('a.mp4', 90, 100, proof_of_play.COMPLETED)])
+        log = self.create_log()
+        # These two paths have the same CRC32, they must still be counted
+        # apart.
+        log.record('b.mp4', 100, 110, proof_of_play.COMPLETED)
+        log.record('plumless', 110, 120, proof_of_play.COMPLETED)
+        log.record('buckeroo', 120, 130, proof_of_play.STOPPED)
+        log.record('a.mp4', 130, 140, proof_of_play.COMPLETED)
+        log.stop()
+        self.assertEqual(proof_of_play.load_items(self.path), {
+            1: 'a.mp4', 2: 'b.mp4', 3: 'plumless', 4: 'buckeroo'})
+        summary = proof_of_play.summarise(self.path)
+        self.assertEqual(summary['a.mp4']['completed'], 2)
+        self.assertEqual(summary['plumless']['completed'], 1)
+        self.assertEqual(summary['buckeroo']['stopped'], 1)
+
+    def test_unwritable_path_disables_journal(self):
+        blocker = os.path.join(self.path, 'file')
+        open(blocker, 'w').close()
+        log = self.create_log(os.path.join(blocker, 'journal'))
+        self.assertIsNone(log._thread)
+        self.assertFalse(log.is_enabled())
+        log.record('a.mp4', 0, 1, proof_of_play.COMPLETED)
+        log.stop()
+        self.assertEqual(os.listdir(self.path), ['file'])
+        self.assertEqual(os.path.getsize(blocker), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()